@@ -1,12 +1,25 @@
 from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from pydantic import BaseModel
 import os
 import re
-from typing import List, Optional, Dict, Any, Tuple
+import json
+import asyncio
+import bisect
+import hashlib
+import heapq
+import random
+import mmap
+import threading
+import time
+import zlib
+from collections import Counter, OrderedDict
+from typing import List, Optional, Dict, Any, Tuple, Iterator, Callable
+import numpy as np
 import pandas as pd
 from pathlib import Path
-import io
 
 app = FastAPI(title="QAlite API")
 
@@ -34,17 +47,175 @@ class MarkdownFile(BaseModel):
     filename: str
     content: Optional[str] = None
     qa_pairs: Optional[List[QAPair]] = None
+    total: Optional[int] = None
+
+
+# ===== 分片目录布局 =====
+
+# 开启后文件按文件名哈希前缀存放到子目录（如 qa_files/3f/xxx.md），
+# 文件列表由清单文件维护，不再遍历目录；对API调用方透明
+QA_SHARDED_LAYOUT = os.environ.get("QA_SHARDED_LAYOUT", "0").lower() in ("1", "true", "yes")
+QA_SHARD_PREFIX_LEN = int(os.environ.get("QA_SHARD_PREFIX_LEN", "2"))
+QA_MANIFEST_PATH = os.path.join(QA_FILES_DIR, ".manifest.jsonl")
+
+_manifest_lock = threading.Lock()
+# 清单中的文件名（用dict保持插入顺序），首次使用时加载
+_manifest: Optional[Dict[str, None]] = None
+# 清单日志中的条目数，用于判断何时重写清单
+_manifest_log_entries = 0
+
+
+def get_shard_name(filename: str) -> str:
+    """根据文件名哈希计算分片子目录名"""
+    return hashlib.md5(filename.encode("utf-8")).hexdigest()[:QA_SHARD_PREFIX_LEN]
+
+
+def get_flat_file_path(filename: str) -> str:
+    """平铺布局下的文件路径"""
+    return os.path.join(QA_FILES_DIR, filename)
+
+
+def get_sharded_file_path(filename: str) -> str:
+    """分片布局下的文件路径"""
+    return os.path.join(QA_FILES_DIR, get_shard_name(filename), filename)
+
+
+def is_shard_dir(name: str) -> bool:
+    """判断目录名是否为分片子目录"""
+    return len(name) == QA_SHARD_PREFIX_LEN and all(c in "0123456789abcdef" for c in name)
+
+
+def scan_sharded_files() -> List[str]:
+    """遍历分片子目录获取全部markdown文件（仅用于重建清单）"""
+    files = []
+    if not os.path.exists(QA_FILES_DIR):
+        return files
+    for name in sorted(os.listdir(QA_FILES_DIR)):
+        shard_path = os.path.join(QA_FILES_DIR, name)
+        if is_shard_dir(name) and os.path.isdir(shard_path):
+            files.extend(f for f in os.listdir(shard_path) if f.endswith('.md'))
+    return files
+
+
+def write_manifest(files: List[str]) -> None:
+    """整体重写清单文件，调用方需持有 _manifest_lock"""
+    global _manifest_log_entries
+    tmp_path = QA_MANIFEST_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for filename in files:
+            f.write(json.dumps({"op": "add", "filename": filename}, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, QA_MANIFEST_PATH)
+    _manifest_log_entries = len(files)
+
+
+def load_manifest() -> Dict[str, None]:
+    """加载清单，不存在时遍历分片目录重建，调用方需持有 _manifest_lock"""
+    global _manifest, _manifest_log_entries
+    if _manifest is not None:
+        return _manifest
+
+    manifest: Dict[str, None] = {}
+    if os.path.exists(QA_MANIFEST_PATH):
+        entries = 0
+        with open(QA_MANIFEST_PATH, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    print("清单中存在损坏的条目，已跳过")
+                    continue
+                entries += 1
+                if entry.get("op") == "add":
+                    manifest[entry["filename"]] = None
+                elif entry.get("op") == "remove":
+                    manifest.pop(entry["filename"], None)
+        _manifest = manifest
+        _manifest_log_entries = entries
+        # 删除记录过多时重写清单
+        if entries > 2 * len(manifest) + 100:
+            write_manifest(list(manifest))
+    else:
+        print("未找到文件清单，遍历分片目录重建")
+        os.makedirs(QA_FILES_DIR, exist_ok=True)
+        manifest = dict.fromkeys(scan_sharded_files())
+        _manifest = manifest
+        write_manifest(list(manifest))
+    return _manifest
+
+
+def append_manifest_entry(op: str, filename: str) -> None:
+    """向清单追加一条记录并更新内存中的清单"""
+    global _manifest_log_entries
+    with _manifest_lock:
+        manifest = load_manifest()
+        if op == "add":
+            if filename in manifest:
+                return
+            manifest[filename] = None
+        else:
+            if filename not in manifest:
+                return
+            manifest.pop(filename)
+
+        with open(QA_MANIFEST_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"op": op, "filename": filename}, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        _manifest_log_entries += 1
+        if _manifest_log_entries > 2 * len(manifest) + 100:
+            write_manifest(list(manifest))
+
+
+def migrate_layout(target: str) -> None:
+    """在平铺布局和分片布局之间迁移已有文件，并重建清单"""
+    global _manifest
+    os.makedirs(QA_FILES_DIR, exist_ok=True)
+    moved = 0
+    if target == "sharded":
+        for filename in os.listdir(QA_FILES_DIR):
+            src = get_flat_file_path(filename)
+            if not filename.endswith('.md') or not os.path.isfile(src):
+                continue
+            dst = get_sharded_file_path(filename)
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            os.replace(src, dst)
+            moved += 1
+        with _manifest_lock:
+            _manifest = dict.fromkeys(scan_sharded_files())
+            write_manifest(list(_manifest))
+        print(f"已迁移 {moved} 个文件到分片布局，请设置 QA_SHARDED_LAYOUT=1 后启动服务")
+    else:
+        for filename in scan_sharded_files():
+            os.replace(get_sharded_file_path(filename), get_flat_file_path(filename))
+            moved += 1
+        for name in os.listdir(QA_FILES_DIR):
+            shard_path = os.path.join(QA_FILES_DIR, name)
+            if is_shard_dir(name) and os.path.isdir(shard_path) and not os.listdir(shard_path):
+                os.rmdir(shard_path)
+        if os.path.exists(QA_MANIFEST_PATH):
+            os.remove(QA_MANIFEST_PATH)
+        print(f"已迁移 {moved} 个文件到平铺布局，请取消 QA_SHARDED_LAYOUT 后启动服务")
 
 
 # ===== 文件操作工具函数 =====
 
 def get_file_path(filename: str) -> str:
     """获取文件的完整路径"""
-    return os.path.join(QA_FILES_DIR, filename)
+    if QA_SHARDED_LAYOUT:
+        return get_sharded_file_path(filename)
+    return get_flat_file_path(filename)
 
 
 def get_all_markdown_files() -> List[str]:
     """获取所有markdown文件列表"""
+    if QA_SHARDED_LAYOUT:
+        with _manifest_lock:
+            return list(load_manifest())
     if not os.path.exists(QA_FILES_DIR):
         return []
     return [f for f in os.listdir(QA_FILES_DIR) if f.endswith('.md')]
@@ -66,10 +237,28 @@ def read_markdown_file(filename: str) -> str:
 
 
 def write_markdown_file(filename: str, content: str) -> None:
-    """写入markdown文件内容"""
+    """写入markdown文件内容（临时文件 + 原子替换）"""
     file_path = get_file_path(filename)
-    with open(file_path, "w", encoding="utf-8") as f:
-        f.write(content)
+    is_new = not os.path.exists(file_path)
+    if QA_SHARDED_LAYOUT:
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    # 先写临时文件再原子替换：读取方（mmap惰性读取、预热和搜索线程）不持有文件锁，
+    # 原地截断重写会让它们读到空文件或半个文件，mmap读到被截断的区域时进程直接崩溃
+    tmp_path = f"{file_path}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    invalidate_qa_cache(filename)
+    bump_corpus_version()
+    if QA_SHARDED_LAYOUT and is_new:
+        append_manifest_entry("add", filename)
 
 
 def delete_markdown_file(filename: str) -> None:
@@ -77,7 +266,15 @@ def delete_markdown_file(filename: str) -> None:
     file_path = get_file_path(filename)
     if not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="文件不存在")
+    discard_journal(filename)
     os.remove(file_path)
+    invalidate_qa_cache(filename)
+    bump_corpus_version()
+    replace_suggest_file(filename, None)
+    mark_dedupe_dirty(filename)
+    emit_changes(filename, [{"op": "file_delete"}])
+    if QA_SHARDED_LAYOUT:
+        append_manifest_entry("remove", filename)
 
 
 # ===== Markdown解析与生成工具函数 =====
@@ -109,61 +306,15 @@ def parse_markdown_to_qa_pairs(content: str) -> List[QAPair]:
     table_content = table_match.group(0)
     print(f"找到表格内容，长度: {len(table_content)}")
 
-    # 使用pandas读取markdown表格
-    try:
-        # 将markdown表格转换为CSV格式以便pandas读取
-        csv_content = io.StringIO()
+    lines = table_content.split('\n')
+    has_user_answer = "用户回答" in lines[0]
+    print(f"表格是否包含用户回答列: {has_user_answer}")
 
-        lines = table_content.split('\n')
-        header_line = lines[0] if lines else ""
-        has_user_answer = "用户回答" in header_line
-        
-        print(f"表格是否包含用户回答列: {has_user_answer}")
-
-        for i, line in enumerate(lines):
-            if i <= 1:  # 跳过表头和分隔行
-                continue
-
-            # 提取行内容并转换为CSV
-            if '|' in line:
-                cells = line.split('|')
-                if len(cells) >= 3:
-                    # 移除首尾的空单元格
-                    cells = cells[1:-1] if cells[0].strip() == '' and cells[-1].strip() == '' else cells
-                    question = cells[0].strip()
-                    answer = cells[1].strip() if len(cells) > 1 else ""
-                    user_answer = cells[2].strip() if has_user_answer and len(cells) > 2 else ""
-                    
-                    if has_user_answer:
-                        csv_content.write(f'"{question}","{answer}","{user_answer}"\n')
-                    else:
-                        csv_content.write(f'"{question}","{answer}",""\n')
-
-        csv_content.seek(0)
-        if csv_content.getvalue().strip():
-            column_names = ["问题", "答案", "用户回答"] if has_user_answer else ["问题", "答案", "用户回答"]
-            df = pd.read_csv(csv_content, header=None, names=column_names)
-
-            # 转换为QAPair对象
-            for _, row in df.iterrows():
-                question = row["问题"] if not pd.isna(row["问题"]) else ""
-                answer = row["答案"] if not pd.isna(row["答案"]) else ""
-                user_answer = row["用户回答"] if not pd.isna(row["用户回答"]) else ""
-
-                # 将特殊标记转换回换行符
-                question = question.replace(" [换行] ", "\n") if isinstance(question, str) else ""
-                answer = answer.replace(" [换行] ", "\n") if isinstance(answer, str) else ""
-                user_answer = user_answer.replace(" [换行] ", "\n") if isinstance(user_answer, str) else ""
-
-                # 只添加非空的行
-                if question.strip() or answer.strip():
-                    qa_pairs.append(QAPair(
-                        question=question, 
-                        answer=answer,
-                        userAnswer=user_answer
-                    ))
-    except Exception as e:
-        print(f"解析表格出错: {str(e)}")
+    # 逐行解析规则与大文件的惰性读取（iter_markdown_qa_pairs）共用，同一文件无论大小解析结果一致
+    for line in lines[2:]:  # 跳过表头和分隔行
+        qa = parse_table_row(line.rstrip("\r"), has_user_answer)
+        if qa is not None:
+            qa_pairs.append(qa)
 
     print(f"解析完成，QA对数量: {len(qa_pairs)}")
     return qa_pairs
@@ -218,24 +369,548 @@ def create_empty_markdown(filename: str) -> str:
     return f"# {title}\nQA速记笔记本\n\n## 问答\n| 问题 | 答案 |\n|------|------|\n"
 
 
+# ===== 大文件惰性读取 =====
+
+# 与 parse_markdown_to_qa_pairs 中的表头规则一致，直接在字节上匹配
+TABLE_HEADER_PATTERN = re.compile(r"\|\s*问题\s*\|\s*答案\s*(?:\|\s*用户回答\s*)?\|".encode("utf-8"))
+
+
+def parse_table_row(line: str, has_user_answer: bool) -> Optional[QAPair]:
+    """解析表格中的一行，非数据行或空行返回None"""
+    if '|' not in line:
+        return None
+    cells = line.split('|')
+    if len(cells) < 3:
+        return None
+
+    # 移除首尾的空单元格
+    cells = cells[1:-1] if cells[0].strip() == '' and cells[-1].strip() == '' else cells
+    question = cells[0].strip().replace(" [换行] ", "\n")
+    answer = cells[1].strip().replace(" [换行] ", "\n") if len(cells) > 1 else ""
+    user_answer = cells[2].strip().replace(" [换行] ", "\n") if has_user_answer and len(cells) > 2 else ""
+
+    if not (question.strip() or answer.strip()):
+        return None
+    return QAPair(question=question, answer=answer, userAnswer=user_answer)
+
+
+def iter_markdown_qa_pairs(filename: str) -> Iterator[QAPair]:
+    """通过mmap按字节扫描表格并逐行产出QA对，峰值内存与文件大小无关"""
+    file_path = get_file_path(filename)
+    if not os.path.exists(file_path):
+        raise HTTPException(status_code=404, detail="文件不存在")
+    if os.path.getsize(file_path) == 0:
+        return
+
+    with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        header_match = TABLE_HEADER_PATTERN.search(mm)
+        if not header_match:
+            return
+        has_user_answer = "用户回答".encode("utf-8") in header_match.group(0)
+
+        header_end = mm.find(b"\n", header_match.end())
+        if header_end == -1:
+            return
+
+        size = len(mm)
+        pos = header_end + 1
+        is_separator = True
+        while pos < size:
+            line_end = mm.find(b"\n", pos)
+            if line_end == -1:
+                line_end = size
+            line = mm[pos:line_end].decode("utf-8", errors="replace").rstrip("\r")
+            pos = line_end + 1
+
+            # 跳过分隔行
+            if is_separator:
+                is_separator = False
+                continue
+            # 空行或下一个标题表示表格结束
+            if line == "" or line.startswith("#"):
+                break
+
+            qa = parse_table_row(line, has_user_answer)
+            if qa is not None:
+                yield qa
+
+
+# ===== 写前日志（WAL）与后台合并 =====
+
+# 开启后，单条增删改只追加到笔记本对应的日志文件并立即返回，
+# 由后台线程按时间或条数阈值把日志合并写回markdown文件
+QA_JOURNAL_ENABLED = os.environ.get("QA_JOURNAL_ENABLED", "0").lower() in ("1", "true", "yes")
+QA_JOURNAL_DIR = os.path.join(QA_FILES_DIR, ".journal")
+QA_JOURNAL_COMPACT_INTERVAL = float(os.environ.get("QA_JOURNAL_COMPACT_INTERVAL", "5"))
+QA_JOURNAL_COMPACT_MAX_ENTRIES = int(os.environ.get("QA_JOURNAL_COMPACT_MAX_ENTRIES", "500"))
+
+_journal_wakeup = threading.Event()
+# 存在待合并日志的笔记本：文件名 -> (表格前缀, 合并日志后的QA对列表)
+_journal_state: Dict[str, Tuple[Optional[str], List[QAPair]]] = {}
+# 每个笔记本待合并的日志条数
+_journal_counts: Dict[str, int] = {}
+# 开启变更日志时，各笔记本中每个(问题, 答案)出现的次数，用于增量计算事件的remaining
+_journal_pair_counts: Dict[str, Counter] = {}
+
+
+def get_journal_lock(filename: str) -> threading.RLock:
+    """笔记本级锁，与文件写锁是同一把：不同笔记本的日志追加、刷盘和合并互不等待"""
+    return get_file_lock(filename)
+
+
+def get_journal_path(filename: str) -> str:
+    """获取笔记本日志文件路径"""
+    return os.path.join(QA_JOURNAL_DIR, filename + ".jsonl")
+
+
+def get_compact_tmp_path(filename: str) -> str:
+    """获取合并时使用的临时文件路径"""
+    return os.path.join(QA_JOURNAL_DIR, filename + ".compact")
+
+
+def qa_pair_to_dict(qa: QAPair) -> Dict[str, Any]:
+    """QA对转为可写入日志的字典"""
+    return {"question": qa.question, "answer": qa.answer, "userAnswer": qa.userAnswer}
+
+
+def read_journal_entries(filename: str) -> List[Dict[str, Any]]:
+    """读取日志条目，跳过崩溃时只写了一半的行"""
+    journal_path = get_journal_path(filename)
+    if not os.path.exists(journal_path):
+        return []
+
+    entries = []
+    with open(journal_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                print(f"日志 {filename} 中存在损坏的条目，已跳过")
+    return entries
+
+
+def apply_journal_entry(qa_pairs: List[QAPair], entry: Dict[str, Any]) -> None:
+    """将一条日志应用到QA对列表上"""
+    op = entry.get("op")
+    index = entry.get("index")
+    if op == "add":
+        qa_pairs.append(QAPair(**entry["qa"]))
+    elif op == "update" and 0 <= index < len(qa_pairs):
+        qa_pairs[index] = QAPair(**entry["qa"])
+    elif op == "delete" and 0 <= index < len(qa_pairs):
+        qa_pairs.pop(index)
+
+
+def load_journal_state(filename: str) -> Tuple[Optional[str], List[QAPair]]:
+    """获取笔记本当前状态（基础文件 + 待合并日志），调用方需持有该笔记本的锁"""
+    if filename not in _journal_state:
+        content = read_markdown_file(filename)
+        qa_pairs = parse_markdown_to_qa_pairs(content)
+        entries = read_journal_entries(filename)
+        for entry in entries:
+            apply_journal_entry(qa_pairs, entry)
+        _journal_state[filename] = (extract_markdown_prefix(content), qa_pairs)
+        _journal_counts[filename] = len(entries)
+    return _journal_state[filename]
+
+
+def append_journal_entry(filename: str, entry: Dict[str, Any]) -> None:
+    """追加一条日志并刷盘，调用方需持有该笔记本的锁"""
+    os.makedirs(QA_JOURNAL_DIR, exist_ok=True)
+    with open(get_journal_path(filename), "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+    _journal_counts[filename] = _journal_counts.get(filename, 0) + 1
+    if _journal_counts[filename] >= QA_JOURNAL_COMPACT_MAX_ENTRIES:
+        _journal_wakeup.set()
+
+
+def journal_mutation(filename: str, entry: Dict[str, Any]) -> List[QAPair]:
+    """以追加日志的方式修改笔记本，返回修改后的QA对列表"""
+    with get_journal_lock(filename):
+        _, qa_pairs = load_journal_state(filename)
+        index = entry.get("index")
+        if entry["op"] != "add" and (index < 0 or index >= len(qa_pairs)):
+            raise HTTPException(status_code=400, detail="无效的索引")
+
+        removed = [qa_pairs[index].question] if entry["op"] != "add" else []
+        added = [entry["qa"]["question"]] if entry["op"] != "delete" else []
+        old_pairs = [qa_pairs[index]] if entry["op"] != "add" else []
+
+        append_journal_entry(filename, entry)
+        apply_journal_entry(qa_pairs, entry)
+        bump_corpus_version()
+        if QA_CHANGE_FEED_ENABLED:
+            new_pairs = [QAPair(**entry["qa"])] if entry["op"] != "delete" else []
+            events = diff_qa_pairs(old_pairs, new_pairs)
+            # 单行比较得到的remaining需按整个文件计算：计数只在首次修改时全量统计，之后按本次增删调整
+            counts = _journal_pair_counts.get(filename)
+            if counts is None:
+                counts = Counter((qa.question, qa.answer) for qa in qa_pairs)
+                _journal_pair_counts[filename] = counts
+            else:
+                counts.subtract((qa.question, qa.answer) for qa in old_pairs)
+                counts.update((qa.question, qa.answer) for qa in new_pairs)
+            for event in events:
+                if event["op"] in ("delete", "update"):
+                    event["remaining"] = counts[(event.get("old_question", event["question"]), event.get("old_answer", event["answer"]))]
+            emit_changes(filename, events)
+        if not adjust_suggest_index(filename, removed, added):
+            replace_suggest_file(filename, qa_pairs)
+        mark_dedupe_dirty(filename)
+        return list(qa_pairs)
+
+
+def compact_journal(filename: str) -> Optional[str]:
+    """
+    将笔记本的待合并日志写回markdown文件，返回写入的内容。
+    顺序为：写临时文件 -> 删除日志 -> 原子替换，任一步崩溃都能在启动时恢复
+    """
+    with get_journal_lock(filename):
+        state = _journal_state.pop(filename, None)
+        _journal_pair_counts.pop(filename, None)
+        if state is None:
+            return None
+        prefix, qa_pairs = state
+        content = generate_markdown_from_qa_pairs(qa_pairs, prefix)
+
+        os.makedirs(QA_JOURNAL_DIR, exist_ok=True)
+        tmp_path = get_compact_tmp_path(filename)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+
+        journal_path = get_journal_path(filename)
+        if os.path.exists(journal_path):
+            os.remove(journal_path)
+        os.replace(tmp_path, get_file_path(filename))
+        invalidate_qa_cache(filename)
+        bump_corpus_version()
+        _journal_counts.pop(filename, None)
+        return content
+
+
+def compact_all_journals() -> None:
+    """合并所有存在待合并日志的笔记本"""
+    pending = [filename for filename, count in _journal_counts.copy().items() if count > 0]
+
+    for filename in pending:
+        try:
+            compact_journal(filename)
+            print(f"已合并笔记本 {filename} 的日志")
+        except Exception as e:
+            print(f"合并笔记本 {filename} 的日志时出错: {str(e)}")
+
+
+def discard_journal(filename: str) -> None:
+    """丢弃笔记本的日志与内存状态（删除笔记本时使用）"""
+    with get_journal_lock(filename):
+        _journal_state.pop(filename, None)
+        _journal_counts.pop(filename, None)
+        _journal_pair_counts.pop(filename, None)
+        for path in (get_journal_path(filename), get_compact_tmp_path(filename)):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def recover_journals() -> None:
+    """启动时恢复崩溃前未完成的合并，并重放所有遗留日志"""
+    if not os.path.isdir(QA_JOURNAL_DIR):
+        return
+
+    for name in os.listdir(QA_JOURNAL_DIR):
+        if not name.endswith(".compact"):
+            continue
+        filename = name[:-len(".compact")]
+        with get_journal_lock(filename):
+            if os.path.exists(get_journal_path(filename)):
+                # 日志还在，说明临时文件未写完，以日志为准
+                os.remove(get_compact_tmp_path(filename))
+            else:
+                # 日志已删除，只差最后一步替换
+                os.replace(get_compact_tmp_path(filename), get_file_path(filename))
+
+    for name in os.listdir(QA_JOURNAL_DIR):
+        if not name.endswith(".jsonl"):
+            continue
+        filename = name[:-len(".jsonl")]
+        if not file_exists(filename):
+            discard_journal(filename)
+            continue
+        print(f"重放笔记本 {filename} 的日志")
+        with get_journal_lock(filename):
+            load_journal_state(filename)
+            compact_journal(filename)
+
+
+def journal_compactor_loop() -> None:
+    """后台合并线程：到达时间间隔或条数阈值时合并日志"""
+    while True:
+        _journal_wakeup.wait(QA_JOURNAL_COMPACT_INTERVAL)
+        _journal_wakeup.clear()
+        compact_all_journals()
+
+
+# ===== 变更日志 =====
+
+# 经由后端的行级增删改追加到变更日志（每行一个JSON事件），MCP服务据此增量同步Chroma。
+# 事件带全局递增的seq和文件级version；日志超过大小上限时轮转为 .1（只保留一个旧分段）
+QA_CHANGE_FEED_ENABLED = os.environ.get("QA_CHANGE_FEED_ENABLED", "0").lower() in ("1", "true", "yes")
+QA_CHANGE_FEED_PATH = os.environ.get("QA_CHANGE_FEED_PATH", os.path.join(QA_FILES_DIR, ".changes.jsonl"))
+QA_CHANGE_FEED_MAX_BYTES = int(os.environ.get("QA_CHANGE_FEED_MAX_BYTES", str(64 * 1024 * 1024)))
+
+_change_feed_lock = threading.Lock()
+_change_feed_seq = 0
+_change_feed_versions: Dict[str, int] = {}
+_change_feed_loaded = False
+
+
+def load_change_feed_state() -> None:
+    """从现有日志恢复最大seq和各文件的version，调用方需持有 _change_feed_lock"""
+    global _change_feed_seq, _change_feed_loaded
+    if _change_feed_loaded:
+        return
+    for path in (QA_CHANGE_FEED_PATH + ".1", QA_CHANGE_FEED_PATH):
+        if not os.path.exists(path):
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except json.JSONDecodeError:
+                    # 崩溃时写了一半的最后一行
+                    continue
+                _change_feed_seq = max(_change_feed_seq, event["seq"])
+                _change_feed_versions[event["file"]] = max(_change_feed_versions.get(event["file"], 0), event["version"])
+    _change_feed_loaded = True
+
+
+def diff_qa_pairs(old_pairs: List[QAPair], new_pairs: List[QAPair]) -> List[Dict[str, Any]]:
+    """
+    按(问题, 答案)多重集合比较前后内容，得到行级事件；只改了一行时合并为一个update事件。
+    delete事件的remaining为文件中仍存在的相同行数，为0时下游才需要删除
+    """
+    old_counts = Counter((qa.question, qa.answer) for qa in old_pairs)
+    new_counts = Counter((qa.question, qa.answer) for qa in new_pairs)
+    removed = list((old_counts - new_counts).elements())
+    added = list((new_counts - old_counts).elements())
+
+    if len(removed) == 1 and len(added) == 1:
+        return [{"op": "update", "old_question": removed[0][0], "old_answer": removed[0][1],
+                 "question": added[0][0], "answer": added[0][1], "remaining": new_counts[removed[0]]}]
+    events = [{"op": "delete", "question": q, "answer": a, "remaining": new_counts[(q, a)]} for q, a in removed]
+    events += [{"op": "add", "question": q, "answer": a} for q, a in added]
+    return events
+
+
+def emit_changes(filename: str, events: List[Dict[str, Any]]) -> None:
+    """为事件分配seq和version后追加到变更日志并刷盘"""
+    global _change_feed_seq
+    if not QA_CHANGE_FEED_ENABLED or not events:
+        return
+    with _change_feed_lock:
+        load_change_feed_state()
+        os.makedirs(os.path.dirname(os.path.abspath(QA_CHANGE_FEED_PATH)), exist_ok=True)
+        if os.path.exists(QA_CHANGE_FEED_PATH) and os.path.getsize(QA_CHANGE_FEED_PATH) >= QA_CHANGE_FEED_MAX_BYTES:
+            os.replace(QA_CHANGE_FEED_PATH, QA_CHANGE_FEED_PATH + ".1")
+
+        version = _change_feed_versions.get(filename, 0) + 1
+        _change_feed_versions[filename] = version
+        now = time.time()
+        lines = []
+        for event in events:
+            _change_feed_seq += 1
+            lines.append(json.dumps({"seq": _change_feed_seq, "ts": now, "file": filename, "version": version, **event},
+                                    ensure_ascii=False))
+        with open(QA_CHANGE_FEED_PATH, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+# ===== 解析结果缓存 =====
+
+# 单个文件超过该大小时不缓存解析结果，搜索和分页改走mmap惰性读取
+QA_CACHE_MAX_FILE_BYTES = int(os.environ.get("QA_CACHE_MAX_FILE_BYTES", str(8 * 1024 * 1024)))
+# 缓存中所有文件的大小之和的上限，超出时淘汰最久未使用的文件
+QA_CACHE_MAX_TOTAL_BYTES = int(os.environ.get("QA_CACHE_MAX_TOTAL_BYTES", str(128 * 1024 * 1024)))
+
+_qa_cache_lock = threading.Lock()
+# 文件名 -> ((mtime_ns, size), 解析后的QA对列表)，按最近使用顺序排列
+_qa_cache: "OrderedDict[str, Tuple[Tuple[int, int], List[QAPair]]]" = OrderedDict()
+_qa_cache_bytes = 0
+
+
+def get_file_signature(filename: str) -> Optional[Tuple[int, int]]:
+    """获取文件的修改时间和大小，用于判断缓存是否失效"""
+    try:
+        stat = os.stat(get_file_path(filename))
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def get_cached_qa_pairs(filename: str) -> Optional[List[QAPair]]:
+    """返回仍然有效的缓存解析结果"""
+    signature = get_file_signature(filename)
+    with _qa_cache_lock:
+        cached = _qa_cache.get(filename)
+        if cached is not None:
+            _qa_cache.move_to_end(filename)
+    if cached is None or cached[0] != signature:
+        return None
+    return list(cached[1])
+
+
+def cache_qa_pairs(filename: str, signature: Optional[Tuple[int, int]], qa_pairs: List[QAPair]) -> None:
+    """缓存解析结果，签名需在读取文件之前获取"""
+    global _qa_cache_bytes
+    if signature is None or signature[1] > QA_CACHE_MAX_FILE_BYTES or signature[1] > QA_CACHE_MAX_TOTAL_BYTES:
+        return
+    with _qa_cache_lock:
+        old = _qa_cache.pop(filename, None)
+        if old is not None:
+            _qa_cache_bytes -= old[0][1]
+        _qa_cache[filename] = (signature, list(qa_pairs))
+        _qa_cache_bytes += signature[1]
+        while _qa_cache_bytes > QA_CACHE_MAX_TOTAL_BYTES:
+            _, (evicted_signature, _) = _qa_cache.popitem(last=False)
+            _qa_cache_bytes -= evicted_signature[1]
+
+
+def invalidate_qa_cache(filename: str) -> None:
+    """使文件的缓存解析结果失效"""
+    global _qa_cache_bytes
+    with _qa_cache_lock:
+        old = _qa_cache.pop(filename, None)
+        if old is not None:
+            _qa_cache_bytes -= old[0][1]
+
+
+def load_cached_qa_pairs(filename: str) -> Optional[List[QAPair]]:
+    """读取并缓存文件解析结果，文件过大不适合缓存时返回None"""
+    cached = get_cached_qa_pairs(filename)
+    if cached is not None:
+        return cached
+
+    signature = get_file_signature(filename)
+    if signature is None:
+        raise HTTPException(status_code=404, detail="文件不存在")
+    if signature[1] > QA_CACHE_MAX_FILE_BYTES:
+        return None
+
+    qa_pairs = parse_markdown_to_qa_pairs(read_markdown_file(filename))
+    cache_qa_pairs(filename, signature, qa_pairs)
+    return qa_pairs
+
+
 # ===== 文件操作集成函数 =====
 
+_file_locks_guard = threading.Lock()
+_file_locks: Dict[str, threading.RLock] = {}
+
+
+def get_file_lock(filename: str) -> threading.RLock:
+    """获取文件级写锁，保证同一文件的读改写在线程池中串行执行"""
+    with _file_locks_guard:
+        if filename not in _file_locks:
+            _file_locks[filename] = threading.RLock()
+        return _file_locks[filename]
+
+
+def read_qa_file_content(filename: str) -> str:
+    """读取文件内容，存在待合并日志时返回合并后的内容"""
+    with get_journal_lock(filename):
+        if filename in _journal_state:
+            prefix, qa_pairs = _journal_state[filename]
+            return generate_markdown_from_qa_pairs(qa_pairs, prefix)
+    return read_markdown_file(filename)
+
+
+def read_mutation_content(filename: str) -> Optional[str]:
+    """
+    单条增删改后随响应返回的文件内容。写前日志模式下返回None，
+    不为每次修改重新生成整个表格，需要完整内容时通过GET /api/files/{filename}读取
+    """
+    if QA_JOURNAL_ENABLED:
+        return None
+    return read_qa_file_content(filename)
+
+
 def load_qa_file(filename: str) -> Tuple[str, List[QAPair]]:
     """加载QA文件，返回内容和QA对列表"""
+    with get_journal_lock(filename):
+        if filename in _journal_state:
+            prefix, qa_pairs = _journal_state[filename]
+            return generate_markdown_from_qa_pairs(qa_pairs, prefix), list(qa_pairs)
+
+    signature = get_file_signature(filename)
     content = read_markdown_file(filename)
-    qa_pairs = parse_markdown_to_qa_pairs(content)
+    qa_pairs = get_cached_qa_pairs(filename)
+    if qa_pairs is None:
+        qa_pairs = parse_markdown_to_qa_pairs(content)
+        cache_qa_pairs(filename, signature, qa_pairs)
     return content, qa_pairs
 
 
+def iter_qa_pairs(filename: str) -> Iterator[QAPair]:
+    """惰性遍历文件中的QA对，存在待合并日志时遍历合并后的结果"""
+    with get_journal_lock(filename):
+        if filename in _journal_state:
+            pending = list(_journal_state[filename][1])
+        else:
+            pending = None
+
+    if pending is not None:
+        yield from pending
+        return
+
+    cached = load_cached_qa_pairs(filename)
+    if cached is not None:
+        yield from cached
+    else:
+        yield from iter_markdown_qa_pairs(filename)
+
+
+def load_qa_page(filename: str, offset: int, limit: int) -> Tuple[List[QAPair], int]:
+    """分页读取QA对，返回当前页和总条数"""
+    offset = max(offset, 0)
+    page = []
+    total = 0
+    for qa in iter_qa_pairs(filename):
+        if offset <= total < offset + limit:
+            page.append(qa)
+        total += 1
+    return page, total
+
+
 def save_qa_file(filename: str, qa_pairs: List[QAPair], preserve_prefix: bool = True) -> str:
     """保存QA对到文件，可选是否保留原文件前缀"""
     prefix = None
     if preserve_prefix and file_exists(filename):
         original_content = read_markdown_file(filename)
         prefix = extract_markdown_prefix(original_content)
+    old_pairs = list(iter_qa_pairs(filename)) if QA_CHANGE_FEED_ENABLED and file_exists(filename) else []
 
-    content = generate_markdown_from_qa_pairs(qa_pairs, prefix)
-    write_markdown_file(filename, content)
+    with get_journal_lock(filename):
+        if filename in _journal_state:
+            # 整表覆盖也走合并流程，避免崩溃恢复时把旧日志重放到新内容上
+            _journal_state[filename] = (prefix, list(qa_pairs))
+            content = compact_journal(filename)
+        else:
+            content = generate_markdown_from_qa_pairs(qa_pairs, prefix)
+            write_markdown_file(filename, content)
+
+    replace_suggest_file(filename, qa_pairs)
+    mark_dedupe_dirty(filename)
+    if QA_CHANGE_FEED_ENABLED:
+        emit_changes(filename, diff_qa_pairs(old_pairs, qa_pairs))
     return content
 
 
@@ -248,6 +923,9 @@ def add_qa_pair(filename: str, question: str, answer: str) -> List[QAPair]:
         content = create_empty_markdown(filename)
         write_markdown_file(filename, content)
         qa_pairs = []
+    elif QA_JOURNAL_ENABLED:
+        new_qa = QAPair(question=question, answer=answer)
+        return journal_mutation(filename, {"op": "add", "qa": qa_pair_to_dict(new_qa)})
     else:
         print(f"文件存在，加载现有内容: {filename}")
         content, qa_pairs = load_qa_file(filename)
@@ -269,6 +947,9 @@ def delete_qa_pair(filename: str, index: int) -> List[QAPair]:
     if not file_exists(filename):
         raise HTTPException(status_code=404, detail="文件不存在")
 
+    if QA_JOURNAL_ENABLED:
+        return journal_mutation(filename, {"op": "delete", "index": index})
+
     _, qa_pairs = load_qa_file(filename)
 
     if index < 0 or index >= len(qa_pairs):
@@ -282,19 +963,153 @@ def delete_qa_pair(filename: str, index: int) -> List[QAPair]:
     return qa_pairs
 
 
+def update_qa_pair(filename: str, index: int, qa: QAPair) -> List[QAPair]:
+    """更新文件中的一个QA对"""
+    if not file_exists(filename):
+        raise HTTPException(status_code=404, detail="文件不存在")
+
+    if QA_JOURNAL_ENABLED:
+        return journal_mutation(filename, {"op": "update", "index": index, "qa": qa_pair_to_dict(qa)})
+
+    _, qa_pairs = load_qa_file(filename)
+
+    if index < 0 or index >= len(qa_pairs):
+        raise HTTPException(status_code=400, detail="无效的索引")
+
+    qa_pairs[index] = qa
+
+    save_qa_file(filename, qa_pairs)
+    return qa_pairs
+
+
+# ===== 搜索结果缓存 =====
+
+QA_SEARCH_CACHE_SIZE = int(os.environ.get("QA_SEARCH_CACHE_SIZE", "256"))
+# 语料签名的复查间隔（秒）：间隔内复用上次的签名，不必每次搜索都stat全部文件；设为0每次都复查
+QA_SEARCH_CACHE_REVALIDATE_SECONDS = float(os.environ.get("QA_SEARCH_CACHE_REVALIDATE_SECONDS", "2"))
+
+# 语料版本号：任何经由后端的写入都会递增，缓存的搜索结果只在版本号一致时有效
+_corpus_version = 0
+_corpus_version_lock = threading.Lock()
+# (计算时刻, 语料签名)，由 _corpus_version_lock 保护
+_corpus_signature: Optional[Tuple[float, Tuple[int, int, int]]] = None
+
+_search_cache_lock = threading.Lock()
+# 规范化查询 -> ((语料版本号, 语料签名), 搜索结果)，按最近使用顺序排列
+_search_cache: "OrderedDict[str, Tuple[Tuple[int, Tuple[int, int, int]], List[Dict[str, Any]]]]" = OrderedDict()
+_search_cache_stats = {"hits": 0, "misses": 0}
+
+
+def bump_corpus_version() -> None:
+    """递增语料版本号并清空搜索结果缓存"""
+    global _corpus_version
+    with _corpus_version_lock:
+        _corpus_version += 1
+    with _search_cache_lock:
+        _search_cache.clear()
+
+
+def get_corpus_version() -> int:
+    """获取当前语料版本号"""
+    with _corpus_version_lock:
+        return _corpus_version
+
+
+def get_corpus_signature(filenames: List[str]) -> Tuple[int, int, int]:
+    """
+    语料签名：(文件数, 最大修改时间, 总大小)。MCP写回、手动编辑等后端之外的写入不会递增版本号，
+    由签名的变化使缓存失效。签名在复查间隔内复用，外部写入最多延迟一个间隔后生效
+    """
+    global _corpus_signature
+    now = time.monotonic()
+    with _corpus_version_lock:
+        cached = _corpus_signature
+    if cached is not None and now - cached[0] < QA_SEARCH_CACHE_REVALIDATE_SECONDS:
+        return cached[1]
+
+    latest = 0
+    total_size = 0
+    for filename in filenames:
+        signature = get_file_signature(filename)
+        if signature is None:
+            continue
+        latest = max(latest, signature[0])
+        total_size += signature[1]
+    signature = (len(filenames), latest, total_size)
+    with _corpus_version_lock:
+        _corpus_signature = (now, signature)
+    return signature
+
+
+def normalize_search_query(query: str) -> str:
+    """规范化查询作为缓存键，与搜索时不区分大小写的匹配规则一致"""
+    return query.lower()
+
+
+def get_cached_search(key: str, version: Tuple[int, Tuple[int, int, int]]) -> Optional[List[Dict[str, Any]]]:
+    """返回与当前语料版本和签名一致的缓存结果"""
+    with _search_cache_lock:
+        cached = _search_cache.get(key)
+        if cached is None or cached[0] != version:
+            _search_cache_stats["misses"] += 1
+            return None
+        _search_cache.move_to_end(key)
+        _search_cache_stats["hits"] += 1
+        return list(cached[1])
+
+
+def store_search_result(key: str, version: Tuple[int, Tuple[int, int, int]], results: List[Dict[str, Any]]) -> None:
+    """缓存搜索结果，超出容量时淘汰最久未使用的条目"""
+    if QA_SEARCH_CACHE_SIZE <= 0 or version[0] != get_corpus_version():
+        return
+    with _search_cache_lock:
+        _search_cache[key] = (version, list(results))
+        _search_cache.move_to_end(key)
+        while len(_search_cache) > QA_SEARCH_CACHE_SIZE:
+            _search_cache.popitem(last=False)
+
+
+def render_search_cache_metrics() -> List[str]:
+    """生成搜索结果缓存的Prometheus文本格式指标"""
+    with _search_cache_lock:
+        hits = _search_cache_stats["hits"]
+        misses = _search_cache_stats["misses"]
+        entries = len(_search_cache)
+    return [
+        "# HELP qalite_search_cache_hits_total 搜索结果缓存命中次数",
+        "# TYPE qalite_search_cache_hits_total counter",
+        f"qalite_search_cache_hits_total {hits}",
+        "# HELP qalite_search_cache_misses_total 搜索结果缓存未命中次数",
+        "# TYPE qalite_search_cache_misses_total counter",
+        f"qalite_search_cache_misses_total {misses}",
+        "# HELP qalite_search_cache_entries 当前缓存的查询数",
+        "# TYPE qalite_search_cache_entries gauge",
+        f"qalite_search_cache_entries {entries}",
+        "# HELP qalite_corpus_version 当前语料版本号",
+        "# TYPE qalite_corpus_version gauge",
+        f"qalite_corpus_version {get_corpus_version()}",
+    ]
+
+
 def search_qa_pairs(query: str) -> List[Dict[str, Any]]:
     """在所有文件中搜索匹配的QA对"""
     if not query.strip():
         return []
-        
+
+    # 版本号和签名需在扫描前读取，扫描期间发生写入时结果不会被当作新版本缓存
+    cache_key = normalize_search_query(query)
+    filenames = get_all_markdown_files()
+    version = (get_corpus_version(), get_corpus_signature(filenames))
+    cached = get_cached_search(cache_key, version)
+    if cached is not None:
+        return cached
+
     results = []
     print(f"搜索关键词: {query}")
 
-    for filename in get_all_markdown_files():
+    for filename in filenames:
         try:
-            _, qa_pairs = load_qa_file(filename)
-            
-            for qa in qa_pairs:
+            for qa in iter_qa_pairs(filename):
                 # 检查问题或答案中是否包含搜索词（不区分大小写）
                 if (query.lower() in qa.question.lower() or 
                     query.lower() in qa.answer.lower()):
@@ -310,11 +1125,529 @@ def search_qa_pairs(query: str) -> List[Dict[str, Any]]:
             print(f"搜索文件 {filename} 时出错: {str(e)}")
             
     print(f"搜索完成，找到 {len(results)} 个结果")
+    store_search_result(cache_key, version, results)
     return results
 
 
+# ===== 问题前缀补全 =====
+
+# 单次补全最多扫描的候选数，保证短前缀时也能在亚毫秒级返回
+QA_SUGGEST_SCAN_LIMIT = int(os.environ.get("QA_SUGGEST_SCAN_LIMIT", "2000"))
+
+_suggest_lock = threading.Lock()
+# 按小写问题排序的 (小写问题, 原问题)，用二分查找定位前缀区间
+_suggest_keys: List[Tuple[str, str]] = []
+# 问题 -> 在所有文件中出现的次数
+_suggest_counts: Dict[str, int] = {}
+# 问题 -> 最近一次写入的序号，次数相同时越新越靠前
+_suggest_recency: Dict[str, int] = {}
+# 文件名 -> 该文件中各问题的出现次数
+_suggest_file_questions: Dict[str, Counter] = {}
+_suggest_seq = 0
+# 未开启预热时，首次补全请求全量建立索引；开启预热时由预热线程建立，完成后置为True
+_suggest_build_lock = threading.Lock()
+_suggest_built = False
+
+
+def apply_suggest_delta(filename: str, delta: Counter) -> None:
+    """将单个文件中问题次数的变化应用到补全索引，调用方需持有 _suggest_lock"""
+    global _suggest_seq
+    _suggest_seq += 1
+    file_questions = _suggest_file_questions.setdefault(filename, Counter())
+    for question, change in delta.items():
+        if change == 0:
+            continue
+        file_questions[question] += change
+        if file_questions[question] <= 0:
+            del file_questions[question]
+
+        key = (question.lower(), question)
+        count = _suggest_counts.get(question, 0) + change
+        if count <= 0:
+            _suggest_counts.pop(question, None)
+            _suggest_recency.pop(question, None)
+            i = bisect.bisect_left(_suggest_keys, key)
+            if i < len(_suggest_keys) and _suggest_keys[i] == key:
+                del _suggest_keys[i]
+            continue
+
+        if question not in _suggest_counts:
+            bisect.insort(_suggest_keys, key)
+        _suggest_counts[question] = count
+        if change > 0:
+            _suggest_recency[question] = _suggest_seq
+
+
+def adjust_suggest_index(filename: str, removed: List[str], added: List[str]) -> bool:
+    """按问题的增减增量更新补全索引，文件尚未建立索引时返回False"""
+    delta = Counter(q.strip() for q in added if q.strip())
+    delta.subtract(q.strip() for q in removed if q.strip())
+    with _suggest_lock:
+        if filename not in _suggest_file_questions:
+            return False
+        apply_suggest_delta(filename, delta)
+        return True
+
+
+def replace_suggest_file(filename: str, qa_pairs: Optional[List[QAPair]], only_if_missing: bool = False) -> None:
+    """用文件的最新内容替换其在补全索引中的问题，qa_pairs为None表示文件已删除"""
+    new_questions = Counter(q for q in (qa.question.strip() for qa in qa_pairs or []) if q)
+    with _suggest_lock:
+        if only_if_missing and filename in _suggest_file_questions:
+            return
+        delta = new_questions
+        delta.subtract(_suggest_file_questions.get(filename, Counter()))
+        apply_suggest_delta(filename, delta)
+        if qa_pairs is None:
+            _suggest_file_questions.pop(filename, None)
+
+
+def ensure_suggest_index() -> None:
+    """预热未运行时为所有文件建立补全索引；已由写入路径索引过的文件保持不变"""
+    global _suggest_built
+    with _suggest_build_lock:
+        if _suggest_built:
+            return
+        for filename in get_all_markdown_files():
+            try:
+                replace_suggest_file(filename, list(iter_qa_pairs(filename)), only_if_missing=True)
+            except Exception as e:
+                print(f"为文件 {filename} 建立补全索引时出错: {str(e)}")
+        _suggest_built = True
+
+
+def suggest_questions(prefix: str, limit: int = 10) -> List[Dict[str, Any]]:
+    """返回以prefix开头（不区分大小写）的问题，按出现次数和最近写入排序"""
+    key = prefix.lstrip().lower()
+    if not key:
+        return []
+
+    with _suggest_lock:
+        start = bisect.bisect_left(_suggest_keys, (key,))
+        end = min(start + QA_SUGGEST_SCAN_LIMIT, len(_suggest_keys))
+        candidates = []
+        for i in range(start, end):
+            lower_question, question = _suggest_keys[i]
+            if not lower_question.startswith(key):
+                break
+            candidates.append(question)
+
+        ranked = heapq.nlargest(
+            limit, candidates,
+            key=lambda q: (_suggest_counts[q], _suggest_recency.get(q, 0))
+        )
+        return [{"question": q, "count": _suggest_counts[q]} for q in ranked]
+
+
+# ===== 近似重复检测 =====
+
+# MinHash签名长度和LSH分段数，每段行数 = 签名长度 / 分段数
+QA_DEDUPE_NUM_PERM = int(os.environ.get("QA_DEDUPE_NUM_PERM", "64"))
+QA_DEDUPE_BANDS = int(os.environ.get("QA_DEDUPE_BANDS", "16"))
+QA_DEDUPE_SHINGLE_SIZE = int(os.environ.get("QA_DEDUPE_SHINGLE_SIZE", "3"))
+
+_MINHASH_PRIME = (1 << 31) - 1
+_minhash_rng = random.Random(20240601)
+_MINHASH_A = np.array([_minhash_rng.randint(1, _MINHASH_PRIME - 1) for _ in range(QA_DEDUPE_NUM_PERM)], dtype=np.int64)
+_MINHASH_B = np.array([_minhash_rng.randint(0, _MINHASH_PRIME - 1) for _ in range(QA_DEDUPE_NUM_PERM)], dtype=np.int64)
+
+_dedupe_lock = threading.Lock()
+# 文件名 -> 每行的 (规范化文本的摘要, MinHash签名)，空行为None；只存8字节摘要用于复用签名，不常驻整段文本
+_dedupe_rows: Dict[str, List[Optional[Tuple[bytes, np.ndarray]]]] = {}
+# (分段序号, 分段哈希) -> 落入该桶的 (文件名, 行号)
+_dedupe_buckets: Dict[Tuple[int, int], set] = {}
+# 有写入、需要在下次检测前重建索引的文件
+_dedupe_dirty: set = set()
+# 未开启预热时，首次检测全量建立索引；开启预热时由预热线程建立，完成后置为True
+_dedupe_built = False
+
+
+def normalize_dedupe_text(qa: QAPair) -> str:
+    """规范化问答文本：合并问题和答案，转小写并去除空白和标点"""
+    return re.sub(r"[\W_]+", "", (qa.question + qa.answer).lower())
+
+
+def dedupe_text_digest(text: str) -> bytes:
+    """规范化文本的短摘要，重建索引时据此判断行内容是否变化"""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest()
+
+
+def compute_minhash(text: str) -> np.ndarray:
+    """计算文本字符shingle集合的MinHash签名"""
+    k = QA_DEDUPE_SHINGLE_SIZE
+    shingles = {text[i:i + k] for i in range(max(len(text) - k + 1, 1))}
+    hashes = np.array([zlib.crc32(sh.encode("utf-8")) for sh in shingles], dtype=np.int64)
+    return ((_MINHASH_A[:, None] * hashes[None, :] + _MINHASH_B[:, None]) % _MINHASH_PRIME).min(axis=1)
+
+
+def get_band_keys(signature: np.ndarray) -> List[Tuple[int, int]]:
+    """将签名按LSH分段，返回各段的桶键"""
+    rows = QA_DEDUPE_NUM_PERM // QA_DEDUPE_BANDS
+    return [(band, hash(signature[band * rows:(band + 1) * rows].tobytes())) for band in range(QA_DEDUPE_BANDS)]
+
+
+def index_dedupe_file(filename: str, qa_pairs: Optional[List[QAPair]], only_if_missing: bool = False) -> None:
+    """用文件的最新内容重建其近似重复索引，qa_pairs为None表示文件已删除"""
+    with _dedupe_lock:
+        if only_if_missing and (filename in _dedupe_rows or filename in _dedupe_dirty):
+            return
+        previous_rows = _dedupe_rows.get(filename, [])
+
+    # 签名在锁外计算；未变化的行复用旧签名，只为新文本计算MinHash
+    known = {row[0]: row[1] for row in previous_rows if row is not None}
+    new_rows: List[Optional[Tuple[bytes, np.ndarray]]] = []
+    for qa in qa_pairs or []:
+        text = normalize_dedupe_text(qa)
+        if not text:
+            new_rows.append(None)
+            continue
+        digest = dedupe_text_digest(text)
+        signature = known.get(digest)
+        if signature is None:
+            signature = compute_minhash(text)
+        new_rows.append((digest, signature))
+
+    # 替换行和增删桶在同一临界区内完成，检测时桶中的成员总能在_dedupe_rows中找到
+    with _dedupe_lock:
+        if only_if_missing and (filename in _dedupe_rows or filename in _dedupe_dirty):
+            return
+        old_rows = _dedupe_rows.pop(filename, [])
+        for index, row in enumerate(old_rows):
+            if row is None:
+                continue
+            for key in get_band_keys(row[1]):
+                bucket = _dedupe_buckets.get(key)
+                if bucket is not None:
+                    bucket.discard((filename, index))
+                    if not bucket:
+                        del _dedupe_buckets[key]
+        if qa_pairs is None:
+            return
+        for index, row in enumerate(new_rows):
+            if row is None:
+                continue
+            for key in get_band_keys(row[1]):
+                _dedupe_buckets.setdefault(key, set()).add((filename, index))
+        _dedupe_rows[filename] = new_rows
+
+
+def mark_dedupe_dirty(filename: str) -> None:
+    """标记文件已写入，下次检测前增量重建该文件的索引"""
+    with _dedupe_lock:
+        _dedupe_dirty.add(filename)
+
+
+def refresh_dedupe_index() -> None:
+    """只重建有写入的文件的近似重复索引（未开启预热时首次调用先为所有文件建立索引）"""
+    global _dedupe_built
+    if not _dedupe_built and not QA_WARMUP_ENABLED:
+        for filename in get_all_markdown_files():
+            try:
+                index_dedupe_file(filename, list(iter_qa_pairs(filename)), only_if_missing=True)
+            except Exception as e:
+                print(f"为文件 {filename} 建立近似重复索引时出错: {str(e)}")
+        _dedupe_built = True
+
+    with _dedupe_lock:
+        dirty = list(_dedupe_dirty)
+        _dedupe_dirty.clear()
+
+    for filename in dirty:
+        try:
+            qa_pairs = list(iter_qa_pairs(filename)) if file_exists(filename) else None
+        except HTTPException:
+            qa_pairs = None
+        index_dedupe_file(filename, qa_pairs)
+
+
+def find_duplicate_clusters(threshold: float = 0.8, cross_file_only: bool = False,
+                            limit: int = 100) -> List[Dict[str, Any]]:
+    """通过LSH分桶找出候选对，按MinHash估计的相似度聚类"""
+    refresh_dedupe_index()
+
+    with _dedupe_lock:
+        candidates = set()
+        for bucket in _dedupe_buckets.values():
+            if len(bucket) < 2:
+                continue
+            members = sorted(bucket)
+            for i in range(len(members)):
+                for j in range(i + 1, len(members)):
+                    candidates.add((members[i], members[j]))
+
+        pairs = []
+        for a, b in candidates:
+            if cross_file_only and a[0] == b[0]:
+                continue
+            similarity = float(np.mean(_dedupe_rows[a[0]][a[1]][1] == _dedupe_rows[b[0]][b[1]][1]))
+            if similarity >= threshold:
+                pairs.append((a, b, similarity))
+
+    # 并查集合并相似对
+    parent: Dict[Tuple[str, int], Tuple[str, int]] = {}
+
+    def find(x: Tuple[str, int]) -> Tuple[str, int]:
+        parent.setdefault(x, x)
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for a, b, _ in pairs:
+        parent[find(a)] = find(b)
+
+    clusters: Dict[Tuple[str, int], Dict[str, Any]] = {}
+    for a, b, similarity in pairs:
+        cluster = clusters.setdefault(find(a), {"members": set(), "pairs": []})
+        cluster["members"].update((a, b))
+        cluster["pairs"].append((a, b, similarity))
+
+    # 读取成员的问答内容用于展示
+    file_rows: Dict[str, List[QAPair]] = {}
+    results = []
+    for cluster in sorted(clusters.values(), key=lambda c: len(c["members"]), reverse=True)[:limit]:
+        members = sorted(cluster["members"])
+        items = []
+        for filename, index in members:
+            if filename not in file_rows:
+                file_rows[filename] = list(iter_qa_pairs(filename))
+            qa = file_rows[filename][index] if index < len(file_rows[filename]) else None
+            items.append({
+                "filename": filename,
+                "index": index,
+                "question": qa.question if qa else "",
+                "answer": qa.answer if qa else "",
+            })
+        positions = {member: i for i, member in enumerate(members)}
+        results.append({
+            "size": len(members),
+            "max_similarity": max(p[2] for p in cluster["pairs"]),
+            "items": items,
+            "pairs": [
+                {"a": positions[a], "b": positions[b], "similarity": round(similarity, 4)}
+                for a, b, similarity in sorted(cluster["pairs"], key=lambda p: p[2], reverse=True)
+            ],
+        })
+    return results
+
+
+# ===== 启动预热 =====
+
+QA_WARMUP_ENABLED = os.environ.get("QA_WARMUP_ENABLED", "1").lower() in ("1", "true", "yes")
+# 预热完成比例达到该值即视为可以对外服务
+QA_WARMUP_READY_RATIO = float(os.environ.get("QA_WARMUP_READY_RATIO", "1.0"))
+
+_warmup_lock = threading.Lock()
+_warmup_state: Dict[str, Any] = {
+    "status": "pending",
+    "files_total": 0,
+    "files_loaded": 0,
+    "qa_pairs_loaded": 0,
+    "started_at": None,
+    "finished_at": None,
+}
+
+
+def update_warmup_state(**kwargs: Any) -> None:
+    """更新预热进度"""
+    with _warmup_lock:
+        _warmup_state.update(kwargs)
+
+
+def get_warmup_state() -> Dict[str, Any]:
+    """获取预热进度快照"""
+    with _warmup_lock:
+        return dict(_warmup_state)
+
+
+def is_ready() -> bool:
+    """判断预热进度是否足以在目标延迟内响应请求"""
+    state = get_warmup_state()
+    if state["status"] == "ready":
+        return True
+    if state["status"] != "running" or state["files_total"] == 0:
+        return False
+    return state["files_loaded"] / state["files_total"] >= QA_WARMUP_READY_RATIO
+
+
+def warm_up_caches() -> None:
+    """后台加载文件列表、解析结果缓存、问题补全索引和近似重复索引"""
+    global _suggest_built, _dedupe_built
+    started_at = time.time()
+    files = get_all_markdown_files()
+    update_warmup_state(status="running", files_total=len(files), files_loaded=0,
+                        qa_pairs_loaded=0, started_at=started_at, finished_at=None)
+    print(f"开始预热，共 {len(files)} 个文件")
+
+    qa_pairs_loaded = 0
+    for i, filename in enumerate(files, 1):
+        try:
+            qa_pairs = list(iter_qa_pairs(filename))
+            # 预热期间已被写入路径索引过的文件以写入路径为准
+            replace_suggest_file(filename, qa_pairs, only_if_missing=True)
+            index_dedupe_file(filename, qa_pairs, only_if_missing=True)
+            qa_pairs_loaded += len(qa_pairs)
+        except Exception as e:
+            print(f"预热文件 {filename} 时出错: {str(e)}")
+        update_warmup_state(files_loaded=i, qa_pairs_loaded=qa_pairs_loaded)
+        if i % 100 == 0:
+            print(f"预热进度: {i}/{len(files)}")
+
+    _suggest_built = True
+    _dedupe_built = True
+    update_warmup_state(status="ready", finished_at=time.time())
+    print(f"预热完成，耗时 {time.time() - started_at:.2f} 秒，共 {qa_pairs_loaded} 个QA对")
+
+
+# ===== 准入控制 =====
+
+# 排队超过该时间仍未获得执行槽位时返回503
+QA_ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("QA_ADMISSION_QUEUE_TIMEOUT", "10"))
+# 429/503响应中Retry-After头的秒数
+QA_ADMISSION_RETRY_AFTER = int(os.environ.get("QA_ADMISSION_RETRY_AFTER", "1"))
+
+
+class AdmissionLimiter:
+    """按路由类别限制并发数和排队长度，获得槽位后在线程池中执行处理函数"""
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.active = 0
+        self.waiting = 0
+        self.admitted_total = 0
+        self.rejected_total = 0
+        self.timeout_total = 0
+        self.wait_seconds_sum = 0.0
+        self.wait_seconds_max = 0.0
+        # 在事件循环中首次使用时创建，避免绑定到错误的事件循环
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def run(self, func: Callable[..., Any], *args: Any) -> Any:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        retry_headers = {"Retry-After": str(QA_ADMISSION_RETRY_AFTER)}
+        if self.active + self.waiting >= self.max_concurrency + self.max_queue:
+            self.rejected_total += 1
+            raise HTTPException(status_code=429, detail="请求过多，请稍后重试", headers=retry_headers)
+
+        self.waiting += 1
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=QA_ADMISSION_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.timeout_total += 1
+            raise HTTPException(status_code=503, detail="服务繁忙，请稍后重试", headers=retry_headers)
+        finally:
+            self.waiting -= 1
+
+        waited = time.perf_counter() - started
+        self.admitted_total += 1
+        self.wait_seconds_sum += waited
+        self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+        self.active += 1
+        try:
+            return await run_in_threadpool(func, *args)
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+
+
+ADMISSION_LIMITERS: Dict[str, AdmissionLimiter] = {
+    "search": AdmissionLimiter(
+        "search",
+        int(os.environ.get("QA_LIMIT_SEARCH_CONCURRENCY", "4")),
+        int(os.environ.get("QA_LIMIT_SEARCH_QUEUE", "16")),
+    ),
+    "bulk": AdmissionLimiter(
+        "bulk",
+        int(os.environ.get("QA_LIMIT_BULK_CONCURRENCY", "4")),
+        int(os.environ.get("QA_LIMIT_BULK_QUEUE", "16")),
+    ),
+    "mutation": AdmissionLimiter(
+        "mutation",
+        int(os.environ.get("QA_LIMIT_MUTATION_CONCURRENCY", "16")),
+        int(os.environ.get("QA_LIMIT_MUTATION_QUEUE", "64")),
+    ),
+}
+SEARCH_LIMITER = ADMISSION_LIMITERS["search"]
+BULK_LIMITER = ADMISSION_LIMITERS["bulk"]
+MUTATION_LIMITER = ADMISSION_LIMITERS["mutation"]
+
+
+def render_admission_metrics() -> List[str]:
+    """生成准入控制的Prometheus文本格式指标"""
+    metrics = [
+        ("queue_depth", "gauge", "当前排队中的请求数", lambda l: l.waiting),
+        ("in_flight", "gauge", "当前执行中的请求数", lambda l: l.active),
+        ("concurrency_limit", "gauge", "并发上限", lambda l: l.max_concurrency),
+        ("admitted_total", "counter", "已放行的请求总数", lambda l: l.admitted_total),
+        ("rejected_total", "counter", "因队列已满返回429的请求总数", lambda l: l.rejected_total),
+        ("timeout_total", "counter", "排队超时返回503的请求总数", lambda l: l.timeout_total),
+        ("wait_seconds_sum", "counter", "放行请求的排队时间总和（秒）", lambda l: l.wait_seconds_sum),
+        ("wait_seconds_max", "gauge", "放行请求的最长排队时间（秒）", lambda l: l.wait_seconds_max),
+    ]
+    lines = []
+    for name, metric_type, help_text, getter in metrics:
+        lines.append(f"# HELP qalite_admission_{name} {help_text}")
+        lines.append(f"# TYPE qalite_admission_{name} {metric_type}")
+        for limiter in ADMISSION_LIMITERS.values():
+            lines.append(f'qalite_admission_{name}{{route_class="{limiter.name}"}} {getter(limiter)}')
+    return lines
+
+
+# ===== 生命周期 =====
+
+@app.on_event("startup")
+async def start_journal_compactor():
+    """启动时重放遗留日志，并在开启日志模式时启动后台合并线程"""
+    recover_journals()
+    if QA_JOURNAL_ENABLED:
+        threading.Thread(target=journal_compactor_loop, name="journal-compactor", daemon=True).start()
+
+
+@app.on_event("startup")
+async def start_warmup():
+    """在后台线程中预热缓存，不阻塞服务启动"""
+    if QA_WARMUP_ENABLED:
+        threading.Thread(target=warm_up_caches, name="cache-warmup", daemon=True).start()
+    else:
+        update_warmup_state(status="ready", finished_at=time.time())
+
+
+@app.on_event("shutdown")
+async def flush_journals():
+    """关闭前合并所有待合并日志"""
+    compact_all_journals()
+
+
 # ===== API端点 =====
 
+@app.get("/healthz")
+async def healthz():
+    """存活检查"""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    """就绪检查，预热未完成时返回503及当前进度"""
+    state = get_warmup_state()
+    if not is_ready():
+        return JSONResponse(status_code=503, content=state)
+    return state
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus文本格式的运行指标"""
+    lines = render_admission_metrics() + render_search_cache_metrics()
+    return "\n".join(lines) + "\n"
+
+
 @app.get("/api/files", response_model=List[str])
 async def get_files():
     """获取所有markdown文件列表"""
@@ -322,9 +1655,17 @@ async def get_files():
 
 
 @app.get("/api/files/{filename}", response_model=MarkdownFile)
-async def get_file(filename: str):
-    """获取特定markdown文件内容"""
-    content, qa_pairs = load_qa_file(filename)
+async def get_file(filename: str, offset: int = 0, limit: Optional[int] = None):
+    """获取特定markdown文件内容，指定limit时分页惰性读取且不返回原始内容"""
+    if limit is not None:
+        qa_pairs, total = await BULK_LIMITER.run(load_qa_page, filename, offset, limit)
+        return MarkdownFile(
+            filename=filename,
+            qa_pairs=qa_pairs,
+            total=total
+        )
+
+    content, qa_pairs = await BULK_LIMITER.run(load_qa_file, filename)
 
     return MarkdownFile(
         filename=filename,
@@ -339,19 +1680,23 @@ async def create_file(file: MarkdownFile):
     if not file.filename.endswith('.md'):
         file.filename += '.md'
 
-    # 检查文件是否已存在
-    if file_exists(file.filename):
-        # 返回409状态码和详细错误信息
-        raise HTTPException(
-            status_code=409, 
-            detail=f"文件 '{file.filename}' 已存在，请使用其他名称"
-        )
+    def create() -> str:
+        with get_file_lock(file.filename):
+            # 检查文件是否已存在
+            if file_exists(file.filename):
+                # 返回409状态码和详细错误信息
+                raise HTTPException(
+                    status_code=409,
+                    detail=f"文件 '{file.filename}' 已存在，请使用其他名称"
+                )
 
-    if file.qa_pairs:
-        content = save_qa_file(file.filename, file.qa_pairs, preserve_prefix=False)
-    else:
-        content = create_empty_markdown(file.filename)
-        write_markdown_file(file.filename, content)
+            if file.qa_pairs:
+                return save_qa_file(file.filename, file.qa_pairs, preserve_prefix=False)
+            content = create_empty_markdown(file.filename)
+            write_markdown_file(file.filename, content)
+            return content
+
+    content = await BULK_LIMITER.run(create)
 
     return MarkdownFile(
         filename=file.filename,
@@ -363,10 +1708,13 @@ async def create_file(file: MarkdownFile):
 @app.put("/api/files/{filename}", response_model=MarkdownFile)
 async def update_file(filename: str, file: MarkdownFile):
     """更新markdown文件内容"""
-    if not file_exists(filename):
-        raise HTTPException(status_code=404, detail="文件不存在")
+    def update() -> str:
+        with get_file_lock(filename):
+            if not file_exists(filename):
+                raise HTTPException(status_code=404, detail="文件不存在")
+            return save_qa_file(filename, file.qa_pairs)
 
-    content = save_qa_file(filename, file.qa_pairs)
+    content = await BULK_LIMITER.run(update)
 
     return MarkdownFile(
         filename=filename,
@@ -378,22 +1726,45 @@ async def update_file(filename: str, file: MarkdownFile):
 @app.delete("/api/files/{filename}")
 async def delete_file(filename: str):
     """删除markdown文件"""
-    delete_markdown_file(filename)
+    def delete() -> None:
+        with get_file_lock(filename):
+            delete_markdown_file(filename)
+
+    await BULK_LIMITER.run(delete)
     return {"message": "文件已删除"}
 
 
+@app.get("/api/suggest", response_model=List[dict])
+async def suggest(prefix: str, limit: int = 10):
+    """问题前缀补全，直接查询内存索引，不扫描文件（未开启预热时首次请求先建立索引）"""
+    # 只有一次性的全量建立需要经过准入控制；预热期间直接查询已加载的部分
+    if not _suggest_built and not QA_WARMUP_ENABLED:
+        await SEARCH_LIMITER.run(ensure_suggest_index)
+    return suggest_questions(prefix, max(1, min(limit, 50)))
+
+
+@app.get("/api/duplicates", response_model=List[dict])
+async def get_duplicates(threshold: float = 0.8, cross_file_only: bool = False, limit: int = 100):
+    """检测近似重复的问答对，返回带相似度的聚类"""
+    return await SEARCH_LIMITER.run(find_duplicate_clusters, threshold, cross_file_only, limit)
+
+
 @app.get("/api/search", response_model=List[dict])
 async def search_qa(query: str):
     """全局搜索问答对"""
-    return search_qa_pairs(query)
+    return await SEARCH_LIMITER.run(search_qa_pairs, query)
 
 
 @app.post("/api/files/{filename}/qa", response_model=MarkdownFile)
 async def add_qa_to_file(filename: str, qa: QAPair):
     """向文件添加一个新的问答对"""
     print(f"API接收到添加QA对请求: 文件={filename}, 问题={qa.question}, 答案={qa.answer}")
-    qa_pairs = add_qa_pair(filename, qa.question, qa.answer)
-    content = read_markdown_file(filename)
+
+    def add() -> Tuple[List[QAPair], Optional[str]]:
+        with get_file_lock(filename):
+            return add_qa_pair(filename, qa.question, qa.answer), read_mutation_content(filename)
+
+    qa_pairs, content = await MUTATION_LIMITER.run(add)
 
     print(f"返回结果，QA对数量: {len(qa_pairs)}")
     return MarkdownFile(
@@ -406,8 +1777,27 @@ async def add_qa_to_file(filename: str, qa: QAPair):
 @app.delete("/api/files/{filename}/qa/{index}", response_model=MarkdownFile)
 async def delete_qa_from_file(filename: str, index: int):
     """从文件中删除一个问答对"""
-    qa_pairs = delete_qa_pair(filename, index)
-    content = read_markdown_file(filename)
+    def delete() -> Tuple[List[QAPair], Optional[str]]:
+        with get_file_lock(filename):
+            return delete_qa_pair(filename, index), read_mutation_content(filename)
+
+    qa_pairs, content = await MUTATION_LIMITER.run(delete)
+
+    return MarkdownFile(
+        filename=filename,
+        content=content,
+        qa_pairs=qa_pairs
+    )
+
+
+@app.put("/api/files/{filename}/qa/{index}", response_model=MarkdownFile)
+async def update_qa_in_file(filename: str, index: int, qa: QAPair):
+    """更新文件中的一个问答对"""
+    def update() -> Tuple[List[QAPair], Optional[str]]:
+        with get_file_lock(filename):
+            return update_qa_pair(filename, index, qa), read_mutation_content(filename)
+
+    qa_pairs, content = await MUTATION_LIMITER.run(update)
 
     return MarkdownFile(
         filename=filename,
@@ -417,6 +1807,17 @@ async def delete_qa_from_file(filename: str, index: int):
 
 
 if __name__ == "__main__":
+    import argparse
     import uvicorn
 
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="QAlite backend")
+    parser.add_argument("command", nargs="?", default="serve", choices=["serve", "migrate-layout"],
+                        help="serve: 启动服务；migrate-layout: 迁移qa_files目录布局")
+    parser.add_argument("--to", dest="layout", default="sharded", choices=["sharded", "flat"],
+                        help="迁移的目标布局，默认sharded")
+    args = parser.parse_args()
+
+    if args.command == "migrate-layout":
+        migrate_layout(args.layout)
+    else:
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
@@ -1,19 +1,34 @@
+import asyncio
 import uuid
 import chromadb
 import re
-from uuid import uuid4
 from fastapi import FastAPI, Request
 import os
 import glob
 from dotenv import load_dotenv
-from mcp.server.fastmcp import FastMCP
+from mcp.server.fastmcp import FastMCP, Context
 from starlette.applications import Starlette
 from mcp.server.sse import SseServerTransport
 from starlette.routing import Mount, Route
+from starlette.responses import PlainTextResponse
 from mcp.server import Server
 import uvicorn
 from chromadb.utils.embedding_functions import SentenceTransformerEmbeddingFunction
 import json
+import hashlib
+import heapq
+import math
+import contextlib
+import contextvars
+import inspect
+from collections import OrderedDict
+import functools
+from concurrent.futures import ThreadPoolExecutor
+import sqlite3
+import tempfile
+import threading
+import time
+import numpy as np
 
 load_dotenv()
 
@@ -21,25 +36,752 @@ load_dotenv()
 mcp = FastMCP('qa_md_store')
 
 # Chroma持久化目录
-CHROMA_DB_DIR = "./chroma_db"
-# 全局Chroma Client和Collection
-chroma_client = chromadb.PersistentClient(path=CHROMA_DB_DIR)
-embedding_function = SentenceTransformerEmbeddingFunction(
-    model_name=r"D:\Models_Home\Huggingface\hub\models--BAAI--bge-base-zh\snapshots\0e5f83d4895db7955e4cb9ed37ab73f7ded339b6")
-qa_collection = chroma_client.get_or_create_collection("qa_collection", embedding_function=embedding_function)
+CHROMA_DB_DIR = os.getenv("QA_CHROMA_DB_DIR", "./chroma_db")
+# 嵌入模型：HuggingFace模型名或本地模型目录
+EMBEDDING_MODEL = os.getenv("QA_EMBEDDING_MODEL", "BAAI/bge-base-zh")
+# SSE服务开始监听后是否在后台预加载Chroma和模型
+WARMUP_ON_START = os.getenv("QA_WARMUP_ON_START", "1").lower() in ("1", "true", "yes")
+# 嵌入后端：sentence-transformers（PyTorch fp32）、onnx（ONNX Runtime）、int8（PyTorch动态int8量化）、hash（无需模型文件的确定性哈希向量）
+EMBEDDING_BACKEND = os.getenv("QA_EMBEDDING_BACKEND", "sentence-transformers").lower()
+# onnx后端加载的模型文件（相对模型目录），如 onnx/model_qint8_avx512.onnx；不填时由sentence-transformers自动选择或导出
+ONNX_FILE_NAME = os.getenv("QA_ONNX_FILE_NAME")
+HASH_EMBEDDING_DIM = int(os.getenv("QA_HASH_EMBEDDING_DIM", "768"))
 
 
-# 1. 解析md表格
-def parse_md_qa_table(md_path):
-    with open(md_path, 'r', encoding='utf-8') as f:
-        md_text = f.read()
+# 每个后端都是一个可调用对象：输入文本列表，返回同样条数的向量列表。
+# 不同后端（及不同模型）的向量互不兼容，切换后需要使用新的Chroma目录重新导入
+def create_sentence_transformer_backend():
+    return SentenceTransformerEmbeddingFunction(model_name=EMBEDDING_MODEL)
+
+
+def create_onnx_backend():
+    from sentence_transformers import SentenceTransformer
+    model_kwargs = {"file_name": ONNX_FILE_NAME} if ONNX_FILE_NAME else None
+    model = SentenceTransformer(EMBEDDING_MODEL, device="cpu", backend="onnx", model_kwargs=model_kwargs)
+    return lambda texts: model.encode(list(texts), batch_size=EMBED_BATCH_SIZE).tolist()
+
+
+def create_int8_backend():
+    import torch
+    from sentence_transformers import SentenceTransformer
+    model = SentenceTransformer(EMBEDDING_MODEL, device="cpu")
+    # 只量化Linear层，权重int8、激活运行时动态量化
+    model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return lambda texts: model.encode(list(texts), batch_size=EMBED_BATCH_SIZE).tolist()
+
+
+def create_hash_backend():
+    def embed(texts):
+        vectors = np.zeros((len(texts), HASH_EMBEDDING_DIM), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in lexical_tokens(text):
+                value = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+                vectors[row, value % HASH_EMBEDDING_DIM] += 1.0 if value >> 63 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (vectors / norms).tolist()
+    return embed
+
+
+EMBEDDING_BACKENDS = {
+    "sentence-transformers": create_sentence_transformer_backend,
+    "onnx": create_onnx_backend,
+    "int8": create_int8_backend,
+    "hash": create_hash_backend,
+}
+
+
+def create_embedding_backend(name):
+    if name not in EMBEDDING_BACKENDS:
+        raise ValueError(f"未知的嵌入后端: {name}，可选: {', '.join(EMBEDDING_BACKENDS)}")
+    return EMBEDDING_BACKENDS[name]()
+
+
+def get_embedding_namespace(name=EMBEDDING_BACKEND):
+    """嵌入缓存键的前缀：默认后端沿用模型名，已有缓存继续有效"""
+    if name == "hash":
+        return f"hash:{HASH_EMBEDDING_DIM}"
+    if name == "sentence-transformers":
+        return EMBEDDING_MODEL
+    return f"{EMBEDDING_MODEL}@{name}:{ONNX_FILE_NAME or ''}"
+
+
+# 每个工具调用按分段统计耗时：embed（模型编码）、vector_query（向量检索）、metadata_fetch（按条件读取metadata）、
+# vector_write（写入和删除）、lexical（BM25检索）、file_io（md文件读写）。汇总后由/metrics以Prometheus文本格式导出
+# 单次调用超过该毫秒数时打印慢调用日志（参数只记录类型和长度），0为关闭
+SLOW_CALL_MS = float(os.getenv("QA_SLOW_CALL_MS", "0"))
+TOOL_DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# 当前工具调用的分段统计，run_blocking会把它带到IO线程中
+_current_call = contextvars.ContextVar("qa_current_call", default=None)
+_metrics_lock = threading.Lock()
+tool_metrics = {}
+
+
+@contextlib.contextmanager
+def trace_span(kind, items=0):
+    """把一段代码的耗时和处理条数计入当前工具调用；不在工具调用中时不做统计。可在块内修改span["items"]"""
+    span = {"items": items}
+    call = _current_call.get()
+    started = time.perf_counter()
+    try:
+        yield span
+    finally:
+        if call is not None:
+            elapsed = time.perf_counter() - started
+            with _metrics_lock:
+                stat = call.setdefault(kind, {"seconds": 0.0, "calls": 0, "items": 0, "max_items": 0})
+                stat["seconds"] += elapsed
+                stat["calls"] += 1
+                stat["items"] += span["items"]
+                stat["max_items"] = max(stat["max_items"], span["items"])
+
+
+def record_tool_call(name, elapsed, spans, error):
+    with _metrics_lock:
+        metric = tool_metrics.setdefault(name, {
+            "calls": 0, "errors": 0, "seconds": 0.0, "max_seconds": 0.0,
+            "buckets": [0] * len(TOOL_DURATION_BUCKETS), "spans": {},
+        })
+        metric["calls"] += 1
+        metric["errors"] += int(error)
+        metric["seconds"] += elapsed
+        metric["max_seconds"] = max(metric["max_seconds"], elapsed)
+        for i, bound in enumerate(TOOL_DURATION_BUCKETS):
+            if elapsed <= bound:
+                metric["buckets"][i] += 1
+        for kind, stat in spans.items():
+            total = metric["spans"].setdefault(kind, {"seconds": 0.0, "calls": 0, "items": 0, "max_items": 0})
+            total["seconds"] += stat["seconds"]
+            total["calls"] += stat["calls"]
+            total["items"] += stat["items"]
+            total["max_items"] = max(total["max_items"], stat["max_items"])
+
+
+def redact_value(value):
+    """慢调用日志中的参数只保留类型和长度，问答内容不落日志"""
+    if value is None or isinstance(value, (bool, int, float)):
+        return repr(value)
+    if isinstance(value, (str, bytes, list, tuple, dict, set)):
+        return f"<{type(value).__name__} len={len(value)}>"
+    return f"<{type(value).__name__}>"
+
+
+def log_slow_call(name, func, args, kwargs, elapsed, spans, error):
+    try:
+        bound = inspect.signature(func).bind_partial(*args, **kwargs).arguments
+    except TypeError:
+        bound = dict(enumerate(args), **kwargs)
+    arg_text = ", ".join(f"{key}={redact_value(value)}" for key, value in bound.items()
+                         if not isinstance(value, Context))
+    span_text = " ".join(f"{kind}={stat['seconds'] * 1000:.1f}ms/{stat['calls']}次/{stat['items']}条"
+                         for kind, stat in sorted(spans.items()))
+    status = "失败" if error else "完成"
+    print(f"慢调用: {name} {status}，耗时{elapsed * 1000:.1f}ms [{span_text}] 参数: {arg_text}")
+
+
+def instrument_tool(func):
+    """工具函数装饰器：统计总耗时、失败次数和各分段耗时，超过QA_SLOW_CALL_MS时打印慢调用日志"""
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        spans = {}
+        token = _current_call.set(spans)
+        started = time.perf_counter()
+        error = False
+        try:
+            return await func(*args, **kwargs)
+        except BaseException:
+            error = True
+            raise
+        finally:
+            _current_call.reset(token)
+            elapsed = time.perf_counter() - started
+            record_tool_call(name, elapsed, spans, error)
+            if SLOW_CALL_MS > 0 and elapsed * 1000 >= SLOW_CALL_MS:
+                log_slow_call(name, func, args, kwargs, elapsed, spans, error)
+    return wrapper
+
+
+def format_metrics():
+    """按Prometheus文本格式导出各工具的调用统计"""
+    lines = []
+
+    def family(metric, metric_type, help_text, samples):
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {metric_type}")
+        for labels, value in samples:
+            label_text = ",".join(f'{key}="{val}"' for key, val in labels)
+            lines.append(f"{metric}{{{label_text}}} {value}" if label_text else f"{metric} {value}")
+
+    with _metrics_lock:
+        tools = sorted(tool_metrics.items())
+        family("qa_tool_calls_total", "counter", "Tool calls.",
+               [((("tool", name),), m["calls"]) for name, m in tools])
+        family("qa_tool_errors_total", "counter", "Tool calls that raised.",
+               [((("tool", name),), m["errors"]) for name, m in tools])
+        lines.append("# HELP qa_tool_duration_seconds Tool call latency.")
+        lines.append("# TYPE qa_tool_duration_seconds histogram")
+        for name, m in tools:
+            for bound, count in zip(TOOL_DURATION_BUCKETS, m["buckets"]):
+                lines.append(f'qa_tool_duration_seconds_bucket{{tool="{name}",le="{bound}"}} {count}')
+            lines.append(f'qa_tool_duration_seconds_bucket{{tool="{name}",le="+Inf"}} {m["calls"]}')
+            lines.append(f'qa_tool_duration_seconds_sum{{tool="{name}"}} {m["seconds"]:.6f}')
+            lines.append(f'qa_tool_duration_seconds_count{{tool="{name}"}} {m["calls"]}')
+        family("qa_tool_duration_seconds_max", "gauge", "Slowest tool call.",
+               [((("tool", name),), f'{m["max_seconds"]:.6f}') for name, m in tools])
+
+        spans = [(name, kind, stat) for name, m in tools for kind, stat in sorted(m["spans"].items())]
+        family("qa_tool_span_seconds_total", "counter", "Time spent per span kind inside tool calls.",
+               [((("tool", name), ("span", kind)), f'{stat["seconds"]:.6f}') for name, kind, stat in spans])
+        family("qa_tool_span_calls_total", "counter", "Span count (batches for embed and write spans).",
+               [((("tool", name), ("span", kind)), stat["calls"]) for name, kind, stat in spans])
+        family("qa_tool_span_items_total", "counter", "Items processed per span kind.",
+               [((("tool", name), ("span", kind)), stat["items"]) for name, kind, stat in spans])
+        family("qa_tool_span_items_max", "gauge", "Largest single batch per span kind.",
+               [((("tool", name), ("span", kind)), stat["max_items"]) for name, kind, stat in spans])
+
+    family("qa_query_batches_total", "counter", "Micro-batched query encodes.", [((), query_batch_stats["batches"])])
+    family("qa_query_batch_queries_total", "counter", "Queries encoded through the micro-batcher.",
+           [((), query_batch_stats["queries"])])
+    family("qa_query_batch_max", "gauge", "Largest micro-batch.", [((), query_batch_stats["max_batch"])])
+    family("qa_embedding_cache_hits_total", "counter", "Embedding cache hits.", [((), embedding_cache_stats["hits"])])
+    family("qa_embedding_cache_misses_total", "counter", "Embedding cache misses.",
+           [((), embedding_cache_stats["misses"])])
+    return "\n".join(lines) + "\n"
+
+
+class TracedCollection:
+    """包装Chroma Collection，把检索、读取和写入计入当前工具调用的分段耗时"""
+    SPAN_KINDS = {
+        "query": "vector_query",
+        "get": "metadata_fetch",
+        "upsert": "vector_write",
+        "update": "vector_write",
+        "delete": "vector_write",
+    }
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        kind = self.SPAN_KINDS.get(name)
+        if kind is None:
+            return attr
+
+        @functools.wraps(attr)
+        def traced(*args, **kwargs):
+            with trace_span(kind) as span:
+                result = attr(*args, **kwargs)
+                if name == "query":
+                    span["items"] = sum(len(ids) for ids in result.get("ids") or [])
+                elif name == "get":
+                    span["items"] = len(result.get("ids") or [])
+                else:
+                    span["items"] = len(kwargs.get("ids") or (args[0] if args else []) or [])
+                return result
+        return traced
+
+
+# Chroma Collection和嵌入模型都在首次使用时才初始化，两者互不等待：
+# 只读metadata的工具不需要等模型加载完成
+_qa_collection = None
+_embedding_function = None
+_chroma_init_lock = threading.Lock()
+_model_init_lock = threading.Lock()
+service_state = {
+    "chroma": "not_loaded",
+    "chroma_seconds": None,
+    "model": "not_loaded",
+    "model_seconds": None,
+    "error": None,
+}
+
+
+def get_qa_collection():
+    global _qa_collection
+    if _qa_collection is None:
+        with _chroma_init_lock:
+            if _qa_collection is None:
+                service_state["chroma"] = "loading"
+                started = time.perf_counter()
+                try:
+                    chroma_client = chromadb.PersistentClient(path=CHROMA_DB_DIR)
+                    # 向量全部由 embed_texts 显式计算后传入，Collection本身不绑定嵌入函数
+                    collection = chroma_client.get_or_create_collection("qa_collection", embedding_function=None)
+                    ensure_qa_meta(collection)
+                    _qa_collection = TracedCollection(collection)
+                except Exception as e:
+                    service_state["chroma"] = "error"
+                    service_state["error"] = f"Chroma初始化失败: {e}"
+                    raise
+                service_state["chroma"] = "ready"
+                service_state["chroma_seconds"] = round(time.perf_counter() - started, 3)
+    return _qa_collection
+
 
+def get_embedding_function():
+    global _embedding_function
+    if _embedding_function is None:
+        with _model_init_lock:
+            if _embedding_function is None:
+                service_state["model"] = "loading"
+                started = time.perf_counter()
+                try:
+                    _embedding_function = create_embedding_backend(EMBEDDING_BACKEND)
+                except Exception as e:
+                    service_state["model"] = "error"
+                    service_state["error"] = f"模型加载失败: {e}"
+                    raise
+                service_state["model"] = "ready"
+                service_state["model_seconds"] = round(time.perf_counter() - started, 3)
+    return _embedding_function
+
+
+def warm_up_service():
+    """后台预加载Chroma和嵌入模型，失败时只记录状态，首次使用时会再次尝试"""
+    loaders = [("Chroma", get_qa_collection), ("嵌入模型", get_embedding_function)]
+    if RAG_MODE == "hybrid":
+        loaders.append(("关键词索引", ensure_lexical_index))
+    for name, loader in loaders:
+        try:
+            loader()
+            print(f"{name}预加载完成")
+        except Exception as e:
+            print(f"{name}预加载失败: {e}")
+
+# 内容寻址ID的命名空间：相同的(md_file, 问题, 答案)总是得到相同的ID，重复导入不会产生重复记录
+QA_ID_NAMESPACE = uuid.UUID("8fafd494-0876-42cf-81b3-15f1d7f37d6e")
+
+
+def get_md_file_name(md_path):
+    """由md文件路径得到存入metadata的md_file名（小写、不含扩展名）"""
+    return os.path.basename(os.path.splitext(md_path)[0].lower())
+
+
+def make_qa_id(md_file, question, answer):
     """
-    解析markdown中的QA表格，转为Qn:... An:... </end>格式
+    根据md_file、规范化后的问题和答案生成确定性ID。
+    导入时单元格中的[换行]已还原为换行，add_qa_pairs和update_qa存的是safe_text后的[换行]，先统一成换行再计算
     """
-    lines = md_text.splitlines()
+    normalized_question = " ".join(question.replace('[换行]', '\n').split())
+    normalized_answer = answer.replace('[换行]', '\n').strip()
+    return str(uuid.uuid5(QA_ID_NAMESPACE, f"{md_file}\x00{normalized_question}\x00{normalized_answer}"))
+
+
+# Chroma不能按metadata排序，也不能按条件廉价计数：每条记录写入时分配递增的seq存入metadata作为稳定排序键，
+# 各md_file的条数、导入时间和内容哈希维护在旁路SQLite表（文件清单）中。seq的分配和Chroma写入在同一把锁内完成，Chroma内部的返回顺序与seq顺序一致。
+# 新写入Chroma的记录（包括修改内容后换了ID的记录）总是分配新的seq，已有记录覆盖写入时沿用原seq
+QA_META_PATH = os.getenv("QA_META_PATH", os.path.join(CHROMA_DB_DIR, "qa_meta.sqlite3"))
+
+_qa_meta_lock = threading.RLock()
+_qa_meta_conn = None
+MD_FILE_MANIFEST_COLUMNS = [
+    ("content_hash", "TEXT"),
+    ("source_path", "TEXT"),
+    ("last_import_at", "REAL"),
+    ("updated_at", "REAL"),
+    ("last_export_at", "REAL"),
+    ("export_path", "TEXT"),
+    ("source_rows", "INTEGER"),
+]
+
+
+def get_qa_meta_conn():
+    global _qa_meta_conn
+    if _qa_meta_conn is None:
+        os.makedirs(os.path.dirname(os.path.abspath(QA_META_PATH)), exist_ok=True)
+        conn = sqlite3.connect(QA_META_PATH, check_same_thread=False)
+        conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS md_files (md_file TEXT PRIMARY KEY, rows INTEGER NOT NULL)")
+        # 文件清单列，旧版本创建的表按需补上
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(md_files)")}
+        for column, column_type in MD_FILE_MANIFEST_COLUMNS:
+            if column not in columns:
+                conn.execute(f"ALTER TABLE md_files ADD COLUMN {column} {column_type}")
+        conn.commit()
+        _qa_meta_conn = conn
+    return _qa_meta_conn
+
+
+# 元数据结构版本：旧版本写入的记录缺少的字段在rebuild_qa_meta中一次性补齐
+QA_META_SCHEMA_VERSION = 2
+
+
+def build_qa_metadata(question, answer, md_file, row=None):
+    """写入Chroma的metadata：complete和长度字段用于按where条件筛选缺失问题或答案的记录，row为在源md表格中的位置"""
+    question_len = len(question.strip())
+    answer_len = len(answer.strip())
+    metadata = {
+        "question": question,
+        "answer": answer,
+        "md_file": md_file,
+        "complete": question_len > 0 and answer_len > 0,
+        "question_len": question_len,
+        "answer_len": answer_len,
+    }
+    if row is not None:
+        metadata["row"] = row
+    return metadata
+
+
+def rebuild_qa_meta(collection):
+    """扫描全库重建各md_file的条数，按Chroma返回顺序给缺少seq的旧记录补上seq，并补齐complete等字段"""
+    results = collection.get(include=["metadatas"])
+    ids = results.get("ids", [])
+    metadatas = results.get("metadatas", [])
+    next_seq = max((meta.get("seq", -1) for meta in metadatas), default=-1) + 1
+    counts = {}
+    backfill_ids = []
+    backfill_metas = []
+    for qa_id, meta in zip(ids, metadatas):
+        md_file = meta.get("md_file", "")
+        counts[md_file] = counts.get(md_file, 0) + 1
+        if "seq" not in meta or "complete" not in meta:
+            patched = {**meta, **build_qa_metadata(meta.get("question", ""), meta.get("answer", ""), meta.get("md_file", ""))}
+            if "md_file" not in meta:
+                del patched["md_file"]
+            if "seq" not in meta:
+                patched["seq"] = next_seq
+                next_seq += 1
+            backfill_ids.append(qa_id)
+            backfill_metas.append(patched)
+    for i in range(0, len(backfill_ids), UPSERT_BATCH_SIZE):
+        collection.update(ids=backfill_ids[i:i + UPSERT_BATCH_SIZE], metadatas=backfill_metas[i:i + UPSERT_BATCH_SIZE])
+    conn = get_qa_meta_conn()
+    # 只重算条数，保留清单中已有的导入时间和哈希
+    now = time.time()
+    conn.execute("UPDATE md_files SET rows = 0")
+    conn.executemany(
+        "INSERT INTO md_files (md_file, rows, updated_at) VALUES (?, ?, ?) ON CONFLICT(md_file) DO UPDATE SET rows = excluded.rows",
+        [(md_file, rows, now) for md_file, rows in counts.items()]
+    )
+    conn.execute("DELETE FROM md_files WHERE rows <= 0")
+    conn.execute("INSERT OR REPLACE INTO counters (name, value) VALUES ('seq', ?)", (next_seq,))
+    conn.execute("INSERT OR REPLACE INTO counters (name, value) VALUES ('schema_version', ?)", (QA_META_SCHEMA_VERSION,))
+    conn.commit()
+    if backfill_ids:
+        print(f"已为{len(backfill_ids)}条旧记录补充seq/complete等元数据")
+
+
+def ensure_qa_meta(collection):
+    """旁路表记录的总条数与Chroma不一致（首次升级或数据目录被替换）或元数据结构版本较旧时重建"""
+    with _qa_meta_lock:
+        conn = get_qa_meta_conn()
+        total = conn.execute("SELECT COALESCE(SUM(rows), 0) FROM md_files").fetchone()[0]
+        seq_known = conn.execute("SELECT COUNT(*) FROM counters WHERE name = 'seq'").fetchone()[0]
+        version = conn.execute("SELECT value FROM counters WHERE name = 'schema_version'").fetchone()
+        if total != collection.count() or not seq_known or not version or version[0] < QA_META_SCHEMA_VERSION:
+            rebuild_qa_meta(collection)
+
+
+def allocate_seq(n):
+    """分配n个连续的seq，返回第一个（需在_qa_meta_lock内调用）"""
+    conn = get_qa_meta_conn()
+    row = conn.execute("SELECT value FROM counters WHERE name = 'seq'").fetchone()
+    start = row[0] if row else 0
+    conn.execute("INSERT OR REPLACE INTO counters (name, value) VALUES ('seq', ?)", (start + n,))
+    conn.commit()
+    return start
+
+
+def adjust_md_file_rows(deltas):
+    """按 {md_file: 增量} 调整条数，条数归零的md_file从表中移除"""
+    deltas = {md_file: delta for md_file, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    with _qa_meta_lock:
+        conn = get_qa_meta_conn()
+        now = time.time()
+        conn.executemany(
+            "INSERT INTO md_files (md_file, rows, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(md_file) DO UPDATE SET rows = rows + excluded.rows, updated_at = excluded.updated_at",
+            [(md_file, delta, now) for md_file, delta in deltas.items()]
+        )
+        conn.execute("DELETE FROM md_files WHERE rows <= 0")
+        conn.commit()
+
+
+def record_md_file_import(md_file, content_hash, source_path, source_rows):
+    """导入完成后记录源文件哈希、解析出的条数和导入时间（该md_file没有任何记录时不入清单）"""
+    with _qa_meta_lock:
+        conn = get_qa_meta_conn()
+        conn.execute(
+            "UPDATE md_files SET content_hash = ?, source_path = ?, source_rows = ?, last_import_at = ? WHERE md_file = ?",
+            (content_hash, os.path.abspath(source_path), source_rows, time.time(), md_file)
+        )
+        conn.commit()
+
+
+def is_md_file_imported(md_file, content_hash, source_path):
+    """
+    源文件内容未变、且库中该md_file的条数与导入时解析出的条数一致时返回条数，否则返回None。
+    清单与Chroma存放在同一目录，换用新的Chroma目录时清单为空，不会误跳过
+    """
+    get_qa_collection()
+    with _qa_meta_lock:
+        row = get_qa_meta_conn().execute(
+            "SELECT rows, content_hash, source_path, source_rows FROM md_files WHERE md_file = ?", (md_file,)
+        ).fetchone()
+    if row and row[1] == content_hash and row[2] == os.path.abspath(source_path) and row[0] == row[3]:
+        return row[0]
+    return None
+
+
+def record_md_file_export(md_file, export_path):
+    with _qa_meta_lock:
+        conn = get_qa_meta_conn()
+        conn.execute(
+            "UPDATE md_files SET last_export_at = ?, export_path = ? WHERE md_file = ?",
+            (time.time(), os.path.abspath(export_path), md_file)
+        )
+        conn.commit()
+
+
+def record_md_file_writeback(md_file, content_hash):
+    """写回源文件后更新清单中的内容哈希"""
+    with _qa_meta_lock:
+        conn = get_qa_meta_conn()
+        conn.execute("UPDATE md_files SET content_hash = ?, updated_at = ? WHERE md_file = ?", (content_hash, time.time(), md_file))
+        conn.commit()
+
+
+def get_md_file_manifest():
+    """返回文件清单：每个md_file一行，不扫描Chroma"""
+    get_qa_collection()
+    with _qa_meta_lock:
+        rows = get_qa_meta_conn().execute(
+            "SELECT md_file, rows, content_hash, source_path, last_import_at, updated_at, last_export_at, export_path "
+            "FROM md_files WHERE md_file != '' ORDER BY md_file"
+        ).fetchall()
+    keys = ["md_file", "rows", "content_hash", "source_path", "last_import_at", "updated_at", "last_export_at", "export_path"]
+    return [dict(zip(keys, row)) for row in rows]
+
+
+def count_qa_pairs(md_file=None):
+    if not md_file:
+        return get_qa_collection().count()
+    with _qa_meta_lock:
+        row = get_qa_meta_conn().execute("SELECT rows FROM md_files WHERE md_file = ?", (md_file,)).fetchone()
+    return row[0] if row else 0
+
+
+# 嵌入向量持久化缓存：以 hash(模型/后端 + 文本) 为键存入SQLite，跨重启、跨md_file复用已计算的向量
+EMBEDDING_CACHE_PATH = os.getenv("QA_EMBED_CACHE_PATH", "./embedding_cache.sqlite3")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("QA_EMBED_CACHE_MAX_ENTRIES", "200000"))
+
+_embedding_cache_lock = threading.Lock()
+_embedding_cache_conn = None
+_embedding_cache_size = 0
+embedding_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def get_embedding_cache_conn():
+    global _embedding_cache_conn, _embedding_cache_size
+    if _embedding_cache_conn is None:
+        conn = sqlite3.connect(EMBEDDING_CACHE_PATH, check_same_thread=False)
+        conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)")
+        conn.commit()
+        _embedding_cache_size = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        _embedding_cache_conn = conn
+    return _embedding_cache_conn
+
+
+def embedding_cache_key(text):
+    return hashlib.sha256(f"{get_embedding_namespace()}\x00{text}".encode("utf-8")).hexdigest()
+
+
+def embedding_cache_get_many(keys):
+    """批量查询缓存，返回命中的 {key: 向量}，并刷新命中项的最近使用时间"""
+    found = {}
+    keys = list(keys)
+    with _embedding_cache_lock:
+        conn = get_embedding_cache_conn()
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk).fetchall()
+            for key, vector in rows:
+                found[key] = np.frombuffer(vector, dtype=np.float32).tolist()
+        if found:
+            now = time.time()
+            conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+            conn.commit()
+    return found
+
+
+def embedding_cache_put_many(items):
+    """批量写入缓存，超出容量时按最近使用时间淘汰最旧的条目"""
+    global _embedding_cache_size
+    if not items:
+        return
+    now = time.time()
+    with _embedding_cache_lock:
+        conn = get_embedding_cache_conn()
+        conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+            [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items.items()]
+        )
+        _embedding_cache_size += len(items)
+        if _embedding_cache_size > EMBEDDING_CACHE_MAX_ENTRIES:
+            # 一次淘汰到容量的90%，避免每次写入都触发淘汰
+            evict = _embedding_cache_size - int(EMBEDDING_CACHE_MAX_ENTRIES * 0.9)
+            conn.execute("DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (evict,))
+            _embedding_cache_size = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            embedding_cache_stats["evictions"] += evict
+        conn.commit()
+
+
+def embed_texts(texts):
+    """计算文本向量，先批量查缓存，只把未命中的文本交给模型"""
+    keys = [embedding_cache_key(text) for text in texts]
+    cached = embedding_cache_get_many(set(keys))
+
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in cached and key not in missing:
+            missing[key] = text
+    embedding_cache_stats["hits"] += len(texts) - len(missing)
+    embedding_cache_stats["misses"] += len(missing)
+
+    if missing:
+        with trace_span("embed", len(missing)):
+            vectors = run_model(get_embedding_function(), list(missing.values()))
+        computed = {key: np.asarray(vector, dtype=np.float32).tolist() for key, vector in zip(missing, vectors)}
+        embedding_cache_put_many(computed)
+        cached.update(computed)
+    return [cached[key] for key in keys]
+
+
+# 工具函数都是async的，直接调用模型和Chroma会阻塞事件循环，使其它SSE客户端全部排队。
+# Chroma读写、缓存查询等阻塞操作放到IO线程池执行；模型推理固定在单独的线程池里串行执行，
+# 避免多个线程同时抢占CPU做推理
+BLOCKING_WORKERS = int(os.getenv("QA_BLOCKING_WORKERS", "8"))
+MODEL_WORKERS = int(os.getenv("QA_MODEL_WORKERS", "1"))
+# 并发的rag_qa查询在该时间窗口内合并为一次批量编码
+QUERY_BATCH_WINDOW_MS = float(os.getenv("QA_QUERY_BATCH_WINDOW_MS", "5"))
+QUERY_BATCH_MAX = int(os.getenv("QA_QUERY_BATCH_MAX", "32"))
+
+_blocking_executor = ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix="qa-blocking")
+_model_executor = ThreadPoolExecutor(max_workers=MODEL_WORKERS, thread_name_prefix="qa-model")
+_pending_queries = []
+_query_flush_handle = None
+query_batch_stats = {"batches": 0, "queries": 0, "max_batch": 0}
+
+# rag_qa查询向量的内存LRU：同一会话中重复的查询直接复用向量，不再经过模型和SQLite缓存
+QUERY_CACHE_SIZE = int(os.getenv("QA_QUERY_CACHE_SIZE", "1024"))
+_query_cache = OrderedDict()
+query_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def run_model(func, *args):
+    """在模型线程池中执行推理并等待结果（在IO线程中调用）"""
+    return _model_executor.submit(func, *args).result()
+
+
+async def run_blocking(func, *args, **kwargs):
+    """在IO线程池中执行阻塞调用，不占用事件循环；当前工具调用的分段统计随上下文带入线程"""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_blocking_executor, functools.partial(context.run, func, *args, **kwargs))
+
+
+def _flush_query_batch():
+    global _pending_queries, _query_flush_handle
+    if _query_flush_handle is not None:
+        _query_flush_handle.cancel()
+        _query_flush_handle = None
+    batch, _pending_queries = _pending_queries, []
+    if not batch:
+        return
+    query_batch_stats["batches"] += 1
+    query_batch_stats["queries"] += len(batch)
+    query_batch_stats["max_batch"] = max(query_batch_stats["max_batch"], len(batch))
+
+    def deliver(task):
+        error = task.exception()
+        for i, (_, future) in enumerate(batch):
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(task.result()[i])
+
+    # 合并后的编码不属于某一个调用，在空上下文中执行，耗时由各自的embed_query计入
+    task = contextvars.Context().run(asyncio.ensure_future, run_blocking(embed_texts, [text for text, _ in batch]))
+    task.add_done_callback(deliver)
+
+
+def normalize_query(text):
+    """查询缓存的键：合并空白并转小写"""
+    return " ".join(text.split()).lower()
+
+
+def query_cache_get(key):
+    if QUERY_CACHE_SIZE > 0 and key in _query_cache:
+        _query_cache.move_to_end(key)
+        query_cache_stats["hits"] += 1
+        return _query_cache[key]
+    query_cache_stats["misses"] += 1
+    return None
+
+
+def query_cache_put(key, vector):
+    if QUERY_CACHE_SIZE > 0:
+        _query_cache[key] = vector
+        _query_cache.move_to_end(key)
+        while len(_query_cache) > QUERY_CACHE_SIZE:
+            _query_cache.popitem(last=False)
+            query_cache_stats["evictions"] += 1
+
+
+async def embed_query(text):
+    """编码单条查询：先查内存LRU，未命中的查询在窗口期内合并成一次embed_texts调用"""
+    key = normalize_query(text)
+    vector = query_cache_get(key)
+    if vector is None:
+        with trace_span("embed", 1):
+            vector = await encode_query(key)
+        query_cache_put(key, vector)
+    return vector
+
+
+async def embed_queries(texts):
+    """编码一组查询：LRU未命中的查询合并成一次embed_texts调用"""
+    keys = [normalize_query(text) for text in texts]
+    vectors = {}
+    for key in keys:
+        if key not in vectors:
+            vectors[key] = query_cache_get(key)
+    missing = [key for key, vector in vectors.items() if vector is None]
+    if missing:
+        for key, vector in zip(missing, await run_blocking(embed_texts, missing)):
+            vectors[key] = vector
+            query_cache_put(key, vector)
+    return [vectors[key] for key in keys]
+
+
+async def encode_query(text):
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    _pending_queries.append((text, future))
+    global _query_flush_handle
+    if len(_pending_queries) >= QUERY_BATCH_MAX:
+        _flush_query_batch()
+    elif _query_flush_handle is None:
+        _query_flush_handle = loop.call_later(QUERY_BATCH_WINDOW_MS / 1000, _flush_query_batch)
+    return await future
+
+
+# 1. 解析md表格
+def find_md_qa_rows(lines):
+    """找出“## 问答”表格中的数据行，返回 [(行号, 单元格列表)]"""
     qa_section = False
-    qa_rows = []
+    rows = []
     for idx, line in enumerate(lines):
         if re.match(r"^##\s*问答", line):
             qa_section = True
@@ -56,49 +798,348 @@ def parse_md_qa_table(md_path):
                 # 去除首尾|，按|分割
                 cells = [cell.strip() for cell in line.strip('|').split('|')]
                 if len(cells) >= 2:
-                    qa_rows.append((cells[0], cells[1]))
+                    rows.append((idx, cells))
+    return rows
+
+
+def parse_md_qa_table(md_path):
+    with trace_span("file_io"), open(md_path, 'r', encoding='utf-8') as f:
+        md_text = f.read()
+
+    """
+    解析markdown中的QA表格，转为Qn:... An:... </end>格式
+    """
+    lines = md_text.splitlines()
+    qa_rows = [(cells[0], cells[1]) for _, cells in find_md_qa_rows(lines)]
     # 转换为Qn/An格式
+    md_file = get_md_file_name(md_path)
     output = []
+    seen_ids = set()
     for i, (q, a) in enumerate(qa_rows, 1):
         q = q.replace('[换行]', '\n').replace('目前：', '').strip()
         a = a.replace('[换行]', '\n').strip()
         if q or a:
-
+            qa_id = make_qa_id(md_file, q, a)
+            # 同一文件中完全相同的行只保留一条
+            if qa_id in seen_ids:
+                continue
+            seen_ids.add(qa_id)
             output.append({
-                'id': str(uuid4()),
+                'id': qa_id,
                 'question': q,
                 'answer': a,
+                # 在md表格中的位置，导出时按它还原行序
+                'row': len(output),
             })
     return output
 
 
 # 2. 存入chroma
+# 每次送入模型的文本条数，以及每次写入Chroma的记录条数
+EMBED_BATCH_SIZE = int(os.getenv("QA_EMBED_BATCH_SIZE", "64"))
+UPSERT_BATCH_SIZE = int(os.getenv("QA_UPSERT_BATCH_SIZE", "256"))
+
+
+def upsert_qa_records(ids, documents, metadatas):
+    """按小批量计算向量，再分块写入Chroma，返回(嵌入耗时, 写入耗时)"""
+    started = time.perf_counter()
+    embeddings = []
+    for i in range(0, len(documents), EMBED_BATCH_SIZE):
+        embeddings.extend(embed_texts(documents[i:i + EMBED_BATCH_SIZE]))
+    embed_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    collection = get_qa_collection()
+    for i in range(0, len(ids), UPSERT_BATCH_SIZE):
+        chunk_ids = ids[i:i + UPSERT_BATCH_SIZE]
+        with _qa_meta_lock:
+            # 已存在的记录保留原seq，只有新记录分配seq并计入条数
+            existing = collection.get(ids=chunk_ids, include=["metadatas"])
+            existing_seq = {qa_id: meta.get("seq") for qa_id, meta in zip(existing["ids"], existing["metadatas"])}
+            next_seq = allocate_seq(sum(1 for qa_id in chunk_ids if existing_seq.get(qa_id) is None))
+            chunk_metas = []
+            deltas = {}
+            for qa_id, meta in zip(chunk_ids, metadatas[i:i + UPSERT_BATCH_SIZE]):
+                seq = existing_seq.get(qa_id)
+                if seq is None:
+                    seq = next_seq
+                    next_seq += 1
+                if qa_id not in existing_seq:
+                    deltas[meta.get("md_file", "")] = deltas.get(meta.get("md_file", ""), 0) + 1
+                chunk_metas.append({**meta, "seq": seq})
+            collection.upsert(
+                ids=chunk_ids,
+                documents=documents[i:i + UPSERT_BATCH_SIZE],
+                embeddings=embeddings[i:i + UPSERT_BATCH_SIZE],
+                metadatas=chunk_metas
+            )
+            adjust_md_file_rows(deltas)
+            lexical_index.add_many(chunk_ids, documents[i:i + UPSERT_BATCH_SIZE], [meta.get("md_file", "") for meta in chunk_metas])
+    return embed_seconds, time.perf_counter() - started
+
+
+def delete_qa_records(ids):
+    """从Chroma删除记录并同步扣减各md_file的条数"""
+    if not ids:
+        return
+    collection = get_qa_collection()
+    with _qa_meta_lock:
+        existing = collection.get(ids=list(ids), include=["metadatas"])
+        deltas = {}
+        for meta in existing["metadatas"]:
+            deltas[meta.get("md_file", "")] = deltas.get(meta.get("md_file", ""), 0) - 1
+        collection.delete(ids=list(ids))
+        adjust_md_file_rows(deltas)
+        lexical_index.remove_many(ids)
+
+
 def store_qa_to_chroma(qa_pairs, md_file):
+    if not qa_pairs:
+        return
     ids = []
     documents = []
     metadatas = []
     for qa in qa_pairs:
         ids.append(qa['id'])
         documents.append(qa['question'] + '\n' + qa['answer'])
-        metadatas.append({'question': qa['question'], 'answer': qa['answer'], 'md_file': md_file})
-
-
-        # qa_collection.upsert(
-        #     ids=[qa['id']],
-        #     documents=qa['question'] + '\n' + qa['answer'],
-        #     embeddings=embeddings,
-        #     metadatas=[{'question': qa['question'], 'answer': qa['answer'], 'md_file': md_file}]
-        # )
-    qa_collection.upsert(
-        ids=ids,
-        documents=documents,
-        embeddings=embedding_function(documents),
-        metadatas=metadatas
-    )
+        metadatas.append(build_qa_metadata(qa['question'], qa['answer'], md_file, qa.get('row')))
+    upsert_qa_records(ids, documents, metadatas)
+
+
+def diff_md_file_records(qa_pairs, md_file):
+    """
+    与库中该md_file已有的记录按ID对比，返回(待新增, 待删除的ID, 待更新行位置的[(ID, metadata)])。
+    未变化的行只在md中的位置变了时更新metadata中的row，不重新嵌入。
+    只删除带row、即从md导入的记录；通过add_qa_pairs等方式手动添加到同名md_file下的记录不在文件里，保留不动
+    """
+    existing = get_qa_collection().get(where={"md_file": md_file}, include=["metadatas"])
+    existing_metas = dict(zip(existing.get("ids", []), existing.get("metadatas", [])))
+    new_ids = {qa['id'] for qa in qa_pairs}
+
+    to_add = [qa for qa in qa_pairs if qa['id'] not in existing_metas]
+    to_delete = [qa_id for qa_id, meta in existing_metas.items() if qa_id not in new_ids and "row" in meta]
+    to_reorder = [
+        (qa['id'], {**existing_metas[qa['id']], "row": qa['row']})
+        for qa in qa_pairs
+        if qa['id'] in existing_metas and existing_metas[qa['id']].get("row") != qa['row']
+    ]
+    return to_add, to_delete, to_reorder
+
+
+def find_existing_qa_ids(ids):
+    """返回ids中库里已存在的ID集合"""
+    collection = get_qa_collection()
+    found = set()
+    for i in range(0, len(ids), UPSERT_BATCH_SIZE):
+        found.update(collection.get(ids=ids[i:i + UPSERT_BATCH_SIZE], include=[])["ids"])
+    return found
+
+
+def update_qa_rows(to_reorder):
+    collection = get_qa_collection()
+    for i in range(0, len(to_reorder), UPSERT_BATCH_SIZE):
+        chunk = to_reorder[i:i + UPSERT_BATCH_SIZE]
+        with _qa_meta_lock:
+            collection.update(ids=[qa_id for qa_id, _ in chunk], metadatas=[meta for _, meta in chunk])
+
+
+# 增量同步：与库中该md_file已有的记录按ID对比，只嵌入新增或变化的行，删除md中已不存在的导入行（手动添加的记录保留）
+def sync_qa_to_chroma(qa_pairs, md_file):
+    to_add, to_delete, to_reorder = diff_md_file_records(qa_pairs, md_file)
+    store_qa_to_chroma(to_add, md_file)
+    if to_delete:
+        delete_qa_records(to_delete)
+    update_qa_rows(to_reorder)
+    return len(to_add), len(to_delete), len(qa_pairs) - len(to_add)
+
+
+# 关键词检索（BM25）：与Chroma向量检索并行执行，用倒数排名融合（RRF）合并，弥补向量检索对API名、错误码、专有名词等精确词的漏召回。
+# 索引常驻内存，首次使用（或预热）时从Chroma全量构建一次，之后随写入和删除增量维护。
+# 默认仅向量检索，设置QA_RAG_MODE=hybrid或调用时传mode="hybrid"才会构建索引
+RAG_MODE = os.getenv("QA_RAG_MODE", "vector")
+HYBRID_VECTOR_WEIGHT = float(os.getenv("QA_HYBRID_VECTOR_WEIGHT", "1.0"))
+HYBRID_LEXICAL_WEIGHT = float(os.getenv("QA_HYBRID_LEXICAL_WEIGHT", "1.0"))
+# 两路各取 top_k * 该倍数 条候选参与融合
+HYBRID_OVERFETCH = int(os.getenv("QA_HYBRID_OVERFETCH", "4"))
+RRF_K = int(os.getenv("QA_RRF_K", "60"))
+
+LEXICAL_WORD_PATTERN = re.compile(r"[a-z0-9_]+(?:[.\-][a-z0-9_]+)*")
+LEXICAL_CJK_PATTERN = re.compile(r"[\u4e00-\u9fff]+")
+
+
+def lexical_tokens(text):
+    """
+    英文/数字按整词（保留 a.b、a-b 形式的标识符），中文按相邻二字切分，只有单个汉字的片段才保留单字。
+    “的”“是”这类单字几乎出现在每条记录中，倒排表与全库一样长，检索时逐条打分却几乎不影响排序
+    """
+    text = text.replace("[换行]", " ").lower()
+    tokens = LEXICAL_WORD_PATTERN.findall(text)
+    for run in LEXICAL_CJK_PATTERN.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class BM25Index:
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.doc_terms = {}
+        self.doc_md_file = {}
+        self.total_len = 0
+        self.lock = threading.Lock()
+        self.ready = False
+
+    def _add(self, doc_id, text, md_file):
+        self._remove(doc_id)
+        counts = {}
+        for token in lexical_tokens(text):
+            counts[token] = counts.get(token, 0) + 1
+        for token, tf in counts.items():
+            self.postings.setdefault(token, {})[doc_id] = tf
+        self.doc_terms[doc_id] = (counts, sum(counts.values()))
+        self.doc_md_file[doc_id] = md_file
+        self.total_len += self.doc_terms[doc_id][1]
+
+    def _remove(self, doc_id):
+        entry = self.doc_terms.pop(doc_id, None)
+        if entry is None:
+            return
+        counts, length = entry
+        for token in counts:
+            docs = self.postings.get(token)
+            if docs is not None:
+                docs.pop(doc_id, None)
+                if not docs:
+                    del self.postings[token]
+        self.doc_md_file.pop(doc_id, None)
+        self.total_len -= length
+
+    def build(self, ids, documents, md_files):
+        with self.lock:
+            self.postings, self.doc_terms, self.doc_md_file, self.total_len = {}, {}, {}, 0
+            for doc_id, text, md_file in zip(ids, documents, md_files):
+                self._add(doc_id, text, md_file)
+            self.ready = True
+
+    def add_many(self, ids, documents, md_files):
+        with self.lock:
+            if not self.ready:
+                return
+            for doc_id, text, md_file in zip(ids, documents, md_files):
+                self._add(doc_id, text, md_file)
+
+    def remove_many(self, ids):
+        with self.lock:
+            if not self.ready:
+                return
+            for doc_id in ids:
+                self._remove(doc_id)
+
+    def search(self, query, limit, md_file=None):
+        """返回按BM25得分降序的 [(doc_id, score)]"""
+        with trace_span("lexical") as span, self.lock:
+            n = len(self.doc_terms)
+            if not n:
+                return []
+            avg_len = self.total_len / n or 1.0
+            scores = {}
+            for token in set(lexical_tokens(query)):
+                docs = self.postings.get(token)
+                if not docs:
+                    continue
+                idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+                for doc_id, tf in docs.items():
+                    if md_file and self.doc_md_file.get(doc_id) != md_file:
+                        continue
+                    length = self.doc_terms[doc_id][1]
+                    score = idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length / avg_len))
+                    scores[doc_id] = scores.get(doc_id, 0.0) + score
+            span["items"] = len(scores)
+            return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+
+
+lexical_index = BM25Index()
+
+
+def ensure_lexical_index():
+    """首次使用时从Chroma全量构建；持有写锁，构建期间的写入不会遗漏"""
+    if lexical_index.ready:
+        return lexical_index
+    collection = get_qa_collection()
+    with _qa_meta_lock:
+        if not lexical_index.ready:
+            started = time.perf_counter()
+            results = collection.get(include=["documents", "metadatas"])
+            lexical_index.build(
+                results.get("ids", []),
+                results.get("documents", []),
+                [meta.get("md_file", "") for meta in results.get("metadatas", [])]
+            )
+            print(f"关键词索引构建完成，共{len(results.get('ids', []))}条，耗时{time.perf_counter() - started:.2f}秒")
+    return lexical_index
+
+
+def fuse_rankings(rankings, weights, limit):
+    """倒数排名融合：score = Σ weight / (RRF_K + rank)"""
+    fused = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, doc_id in enumerate(ranking, 1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + weight / (RRF_K + rank)
+    return [doc_id for doc_id, _ in heapq.nlargest(limit, fused.items(), key=lambda item: item[1])]
+
+
+# 批量导入时并行解析文件的线程数
+IMPORT_WORKERS = int(os.getenv("QA_IMPORT_WORKERS", "4"))
+
+
+def file_content_hash(path):
+    digest = hashlib.sha256()
+    with trace_span("file_io"), open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def collect_md_files(path, pattern="*.md"):
+    """目录则递归匹配pattern，否则把path本身当作glob表达式"""
+    if os.path.isdir(path):
+        files = glob.glob(os.path.join(path, "**", pattern), recursive=True)
+    else:
+        files = glob.glob(path, recursive=True)
+    return sorted(os.path.abspath(f) for f in files if os.path.isfile(f))
+
+
+def prepare_import_file(path, force=False):
+    """在解析线程中执行：计算哈希、解析表格并与库中该md_file的记录对比，得到待新增和待删除的行"""
+    try:
+        content_hash = file_content_hash(path)
+        md_file = get_md_file_name(path)
+        imported_rows = None if force else is_md_file_imported(md_file, content_hash, path)
+        if imported_rows is not None:
+            return {"path": path, "skipped": True, "rows": imported_rows}
+        qa_pairs = parse_md_qa_table(path)
+        to_add, to_delete, to_reorder = diff_md_file_records(qa_pairs, md_file)
+        return {
+            "path": path,
+            "skipped": False,
+            "md_file": md_file,
+            "content_hash": content_hash,
+            "rows": len(qa_pairs),
+            "to_add": to_add,
+            "to_delete": to_delete,
+            "to_reorder": to_reorder,
+        }
+    except Exception as e:
+        return {"path": path, "error": str(e)}
+
 
 # 预览修改QA内容的函数
 def preview_modify_qa(qa_id, new_question=None, new_answer=None):
-    result = qa_collection.get(ids=[qa_id], include=["metadatas"])
+    result = get_qa_collection().get(ids=[qa_id], include=["metadatas"])
     if not result or not result["ids"]:
         return None
     old_question = result["metadatas"][0]["question"]
@@ -113,44 +1154,319 @@ def preview_modify_qa(qa_id, new_question=None, new_answer=None):
 
 # 更新QA的函数
 def update_qa(qa_id, new_question=None, new_answer=None):
-    result = qa_collection.get(ids=[qa_id], include=["metadatas"])
+    result = get_qa_collection().get(ids=[qa_id], include=["metadatas"])
     if not result or not result["ids"]:
         return False
     old_metadata = result["metadatas"][0]
     old_question = old_metadata["question"]
     old_answer = old_metadata["answer"]
-    md_file = old_metadata.get("md_file")
+    md_file = old_metadata.get("md_file", "")
     updated_question = new_question if new_question else old_question
     updated_answer = new_answer if new_answer else old_answer
     question = safe_text(updated_question)
     answer = safe_text(updated_answer)
-    qa_collection.update(
-        ids=[qa_id],
-        documents=[question + '\n' + answer],
-        metadatas=[{**old_metadata, "question": question, "answer": answer}]
-    )
-    return True
+    document = question + '\n' + answer
+    new_id = make_qa_id(md_file, question, answer)
+    embeddings = embed_texts([document])
+    collection = get_qa_collection()
+    with _qa_meta_lock:
+        # 保留原记录的row（导出时仍写回原来的行位置）
+        metadata = {**old_metadata, **build_qa_metadata(question, answer, md_file)}
+        if new_id == qa_id:
+            collection.update(ids=[qa_id], documents=[document], embeddings=embeddings, metadatas=[metadata])
+            lexical_index.add_many([qa_id], [document], [md_file])
+        else:
+            # ID由内容决定，内容变了就换成新ID，否则之后再添加原内容时会覆盖这次修改；
+            # 库中已有与新内容相同的记录时只删除旧记录。
+            # 新ID在Chroma中排在最后，需分配新的seq，保持返回顺序与seq一致，否则按cursor翻页会漏掉它
+            if not collection.get(ids=[new_id], include=[])["ids"]:
+                metadata["seq"] = allocate_seq(1)
+                collection.upsert(ids=[new_id], documents=[document], embeddings=embeddings, metadatas=[metadata])
+                adjust_md_file_rows({md_file: 1})
+                lexical_index.add_many([new_id], [document], [md_file])
+            delete_qa_records([qa_id])
+    writeback_path = enqueue_md_writeback(md_file, "update", old_question, old_answer, question, answer)
+    return {"qa_id": new_id, "md_file": md_file, "writeback_path": writeback_path}
+
+
+# 写回源md文件：Chroma中的修改和删除按md_file攒批，防抖间隔后每个文件只读取、改写一次。
+# 按旧的问题和答案在文件当前内容中定位行，找不到（文件已被外部修改）时记为冲突，不覆盖文件
+WRITEBACK_ENABLED = os.getenv("QA_WRITEBACK_ENABLED", "1").lower() in ("1", "true", "yes")
+WRITEBACK_INTERVAL = float(os.getenv("QA_WRITEBACK_INTERVAL", "2"))
+
+_writeback_cond = threading.Condition()
+_writeback_queue = {}
+_writeback_last_enqueue = {}
+_writeback_thread = None
+writeback_state = {"applied": 0, "files_written": 0, "last_flush_at": None, "conflicts": []}
+
+
+def get_md_file_source(md_file):
+    """由文件清单得到md_file的源文件路径，源文件不存在时返回None"""
+    with _qa_meta_lock:
+        row = get_qa_meta_conn().execute("SELECT source_path FROM md_files WHERE md_file = ?", (md_file,)).fetchone()
+    if row and row[0] and os.path.exists(row[0]):
+        return row[0]
+    return None
+
+
+def enqueue_md_writeback(md_file, op, question, answer, new_question=None, new_answer=None):
+    """登记一次待写回的修改（op为update或delete），返回将要写回的源文件路径；未开启或无源文件时返回None"""
+    global _writeback_thread
+    if not WRITEBACK_ENABLED or not md_file:
+        return None
+    path = get_md_file_source(md_file)
+    if not path:
+        return None
+    with _writeback_cond:
+        _writeback_queue.setdefault(path, []).append((op, question, answer, new_question, new_answer))
+        _writeback_last_enqueue[path] = time.monotonic()
+        if _writeback_thread is None:
+            _writeback_thread = threading.Thread(target=writeback_loop, name="md-writeback", daemon=True)
+            _writeback_thread.start()
+        _writeback_cond.notify()
+    return path
+
+
+def writeback_key(text):
+    """比较单元格时忽略换行占位符和空白差异"""
+    return " ".join(str(text).replace('[换行]', '\n').replace('目前：', '').split())
 
 
-# 更新MD文件中的QA
-def update_md_file(md_path, old_question, old_answer, new_question, new_answer):
-    with open(md_path, 'r', encoding='utf-8') as f:
+def writeback_cell(text):
+    text = str(text).replace('[换行]', '\n').strip()
+    return re.sub(r"\s*\n\s*", " [换行] ", text).replace('|', '｜')
+
+
+def apply_md_writeback(md_path, ops):
+    """对单个文件一次性应用一批修改，返回 (成功条数, 冲突列表)；文件在改写期间被修改时抛出RuntimeError，留待下一轮重试"""
+    stat = os.stat(md_path)
+    with trace_span("file_io"), open(md_path, 'r', encoding='utf-8') as f:
         content = f.read()
-    old_row_pattern = f"\\|\\s*{re.escape(old_question)}\\s*\\|\\s*{re.escape(old_answer)}\\s*\\|"
-    new_row = f"| {new_question} | {new_answer} |"
-    updated_content = re.sub(old_row_pattern, new_row, content)
-    with open(md_path, 'w', encoding='utf-8') as f:
-        f.write(updated_content)
+    lines = content.splitlines()
+    rows = {}
+    for idx, cells in find_md_qa_rows(lines):
+        rows.setdefault((writeback_key(cells[0]), writeback_key(cells[1])), []).append(idx)
+
+    applied = 0
+    conflicts = []
+    removed = set()
+    for op, question, answer, new_question, new_answer in ops:
+        key = (writeback_key(question), writeback_key(answer))
+        indexes = [idx for idx in rows.pop(key, []) if idx not in removed]
+        if not indexes:
+            conflicts.append(f"{os.path.basename(md_path)}: 未找到 问题「{question}」答案「{answer}」（文件可能已被修改），跳过{'删除' if op == 'delete' else '修改'}")
+            continue
+        if op == "delete":
+            removed.update(indexes)
+        else:
+            for idx in indexes:
+                cells = [cell.strip() for cell in lines[idx].strip('|').split('|')]
+                cells[0] = writeback_cell(new_question)
+                cells[1] = writeback_cell(new_answer)
+                lines[idx] = "| " + " | ".join(cells) + " |"
+            # 同一批次中对该行的后续修改按新内容定位
+            rows.setdefault((writeback_key(new_question), writeback_key(new_answer)), []).extend(indexes)
+        applied += 1
+    if not applied:
+        return 0, conflicts
+
+    new_content = "\n".join(line for idx, line in enumerate(lines) if idx not in removed)
+    if content.endswith("\n"):
+        new_content += "\n"
+    if os.stat(md_path).st_mtime_ns != stat.st_mtime_ns:
+        raise RuntimeError(f"{md_path} 在写回期间被修改")
+    tmp_path = md_path + ".writeback.tmp"
+    with trace_span("file_io", applied):
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(new_content)
+        os.replace(tmp_path, md_path)
+    return applied, conflicts
+
+
+def flush_md_writeback(force=False):
+    """写回所有已过防抖间隔的文件（force时写回全部），返回写回的文件数"""
+    now = time.monotonic()
+    with _writeback_cond:
+        paths = [path for path in _writeback_queue if force or now - _writeback_last_enqueue[path] >= WRITEBACK_INTERVAL]
+        batches = {path: _writeback_queue.pop(path) for path in paths}
+    written = 0
+    for path, ops in batches.items():
+        try:
+            applied, conflicts = apply_md_writeback(path, ops)
+        except FileNotFoundError:
+            # 源文件已被删除或移走，重试不会成功，记为冲突并丢弃这批修改
+            applied, conflicts = 0, [f"{os.path.basename(path)}: 源文件已不存在，丢弃{len(ops)}条待写回的修改"]
+        except Exception as e:
+            print(f"写回 {path} 失败，稍后重试: {e}")
+            with _writeback_cond:
+                _writeback_queue[path] = ops + _writeback_queue.get(path, [])
+                _writeback_last_enqueue[path] = time.monotonic()
+            continue
+        if applied:
+            written += 1
+            record_md_file_writeback(get_md_file_name(path), file_content_hash(path))
+        writeback_state["applied"] += applied
+        # 只保留最近的冲突记录
+        writeback_state["conflicts"] = (writeback_state["conflicts"] + conflicts)[-50:]
+        for conflict in conflicts:
+            print(f"写回冲突: {conflict}")
+    writeback_state["files_written"] += written
+    if batches:
+        writeback_state["last_flush_at"] = time.time()
+    return written
+
+
+def writeback_loop():
+    while True:
+        with _writeback_cond:
+            while not _writeback_queue:
+                _writeback_cond.wait()
+            # 等到最近一次登记之后满一个防抖间隔再写
+            wait = WRITEBACK_INTERVAL - (time.monotonic() - min(_writeback_last_enqueue[path] for path in _writeback_queue))
+            if wait > 0:
+                _writeback_cond.wait(wait)
+        try:
+            flush_md_writeback()
+        except Exception as e:
+            print(f"写回md文件失败: {e}")
+
+
+# 跟随后端的变更日志（backend/main.py 开启 QA_CHANGE_FEED_ENABLED 后写出）增量同步Chroma，
+# 不需要再手动重新导入经由网页修改过的笔记本。已应用到的seq记在旁路元数据库中，重启后从断点继续
+CHANGE_FEED_PATH = os.getenv("QA_CHANGE_FEED_PATH", "")
+CHANGE_FEED_POLL_INTERVAL = float(os.getenv("QA_CHANGE_FEED_POLL_INTERVAL", "1"))
+CHANGE_FEED_BATCH = int(os.getenv("QA_CHANGE_FEED_BATCH", "500"))
+
+change_feed_state = {"status": "disabled", "last_seq": 0, "applied_events": 0, "last_applied_at": None, "gap": None, "error": None}
+_change_feed_position = None
+
+
+def feed_text_to_cell(text):
+    """把后端事件中的原文转换成与parse_md_qa_table解析结果一致的形式，保证算出相同的ID"""
+    cell = str(text).replace("\n", " [换行] ").strip()
+    return cell.replace('[换行]', '\n').replace('目前：', '').strip()
+
+
+def get_change_feed_seq():
+    with _qa_meta_lock:
+        row = get_qa_meta_conn().execute("SELECT value FROM counters WHERE name = 'change_feed_seq'").fetchone()
+    return row[0] if row else 0
+
+
+def set_change_feed_seq(seq):
+    with _qa_meta_lock:
+        conn = get_qa_meta_conn()
+        conn.execute("INSERT OR REPLACE INTO counters (name, value) VALUES ('change_feed_seq', ?)", (seq,))
+        conn.commit()
+
+
+def read_change_lines(path, offset):
+    """从offset读取完整的行，返回(行列表, 新offset)；末尾写了一半的行留到下次"""
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read()
+    end = data.rfind(b"\n") + 1
+    return data[:end].decode("utf-8").splitlines(), offset + end
+
+
+def read_change_events(after_seq):
+    """读取seq大于after_seq的新事件；日志被轮转时先补读旧分段"""
+    global _change_feed_position
+    if not os.path.exists(CHANGE_FEED_PATH):
+        return []
+    stat = os.stat(CHANGE_FEED_PATH)
+    lines = []
+    if _change_feed_position is None or _change_feed_position[0] != stat.st_ino or stat.st_size < _change_feed_position[1]:
+        rotated = CHANGE_FEED_PATH + ".1"
+        if os.path.exists(rotated):
+            lines.extend(read_change_lines(rotated, 0)[0])
+        offset = 0
+    else:
+        offset = _change_feed_position[1]
+    new_lines, offset = read_change_lines(CHANGE_FEED_PATH, offset)
+    lines.extend(new_lines)
+    _change_feed_position = (stat.st_ino, offset)
+
+    events = []
+    for line in lines:
+        try:
+            event = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if event["seq"] > after_seq:
+            events.append(event)
+    events.sort(key=lambda event: event["seq"])
+    return events
+
+
+def apply_change_events(events):
+    """把一批事件合并为净变化（同一ID以最后一次为准），再批量删除和写入"""
+    pending = {}
+
+    def flush():
+        deletes = [qa_id for qa_id, row in pending.items() if row is None]
+        adds = [(qa_id, row) for qa_id, row in pending.items() if row is not None]
+        delete_qa_records(deletes)
+        if adds:
+            upsert_qa_records(
+                [qa_id for qa_id, _ in adds],
+                [row[1] + '\n' + row[2] for _, row in adds],
+                [build_qa_metadata(row[1], row[2], row[0]) for _, row in adds]
+            )
+        pending.clear()
+
+    for event in events:
+        md_file = get_md_file_name(event["file"])
+        op = event["op"]
+        if op == "file_delete":
+            flush()
+            existing = get_qa_collection().get(where={"md_file": md_file}, include=[])
+            delete_qa_records(existing.get("ids", []))
+            continue
+        # 文件中还有相同行时Chroma里的那条记录仍然有效
+        if op in ("delete", "update") and not event.get("remaining"):
+            question = feed_text_to_cell(event.get("old_question", event["question"]))
+            answer = feed_text_to_cell(event.get("old_answer", event["answer"]))
+            pending[make_qa_id(md_file, question, answer)] = None
+        if op in ("add", "update"):
+            question = feed_text_to_cell(event["question"])
+            answer = feed_text_to_cell(event["answer"])
+            if question or answer:
+                pending[make_qa_id(md_file, question, answer)] = (md_file, question, answer)
+    flush()
+
+
+def change_feed_loop():
+    change_feed_state["status"] = "running"
+    last_seq = get_change_feed_seq()
+    change_feed_state["last_seq"] = last_seq
+    while True:
+        try:
+            events = read_change_events(last_seq)
+            if events and last_seq and events[0]["seq"] > last_seq + 1:
+                # 服务停机期间日志轮转了不止一次，中间的事件已丢失
+                change_feed_state["gap"] = f"seq {last_seq + 1}~{events[0]['seq'] - 1} 已不在变更日志中，请重新导入相关md文件"
+                print(f"变更日志缺失: {change_feed_state['gap']}")
+            for i in range(0, len(events), CHANGE_FEED_BATCH):
+                batch = events[i:i + CHANGE_FEED_BATCH]
+                apply_change_events(batch)
+                last_seq = batch[-1]["seq"]
+                set_change_feed_seq(last_seq)
+                change_feed_state["last_seq"] = last_seq
+                change_feed_state["applied_events"] += len(batch)
+                change_feed_state["last_applied_at"] = time.time()
+            change_feed_state["error"] = None
+        except Exception as e:
+            # 未成功的批次不推进seq，下一轮重试
+            change_feed_state["error"] = str(e)
+            print(f"应用变更日志失败: {e}")
+        time.sleep(CHANGE_FEED_POLL_INTERVAL)
 
 
 # 获取已经导入Chroma的MD文件列表
 def get_imported_md_files():
-    results = qa_collection.get(include=["metadatas"])
-    md_files = set()
-    for metadata in results["metadatas"]:
-        if "md_file" in metadata:
-            md_files.add(metadata["md_file"])
-    return list(md_files)
+    return [entry["md_file"] for entry in get_md_file_manifest()]
 
 
 def safe_text(text):
@@ -158,62 +1474,232 @@ def safe_text(text):
 
 
 @mcp.tool()
+@instrument_tool
 async def import_md_to_chroma(md_path: str) -> str:
     """
-    处理指定md文件并将所有问答对存入Chroma数据库
+    处理指定md文件并将问答对增量同步到Chroma数据库（只嵌入新增或变化的行，删除md中已不存在的导入行，手动添加的记录保留）
     Args:
         md_path: 需要导入的Markdown文件路径
     Returns:
         导入结果的提示信息
     """
-    md_file  = os.path.splitext(md_path)[0].lower()
-    md_file = os.path.basename(md_file)
+    md_file = get_md_file_name(md_path)
     if not os.path.exists(md_path):
         return f"文件 {md_file} 不存在。"
 
-    qa_pairs = parse_md_qa_table(md_path)
-    if not qa_pairs:
+    content_hash = await run_blocking(file_content_hash, md_path)
+    qa_pairs = await run_blocking(parse_md_qa_table, md_path)
+    added, deleted, unchanged = await run_blocking(sync_qa_to_chroma, qa_pairs, md_file)
+    await run_blocking(record_md_file_import, md_file, content_hash, md_path, len(qa_pairs))
+    if not qa_pairs and not deleted:
         return f"{md_file} 未找到问答对，未导入。"
 
-    store_qa_to_chroma(qa_pairs, md_file)
-    return f"{md_file} 已成功导入Chroma，共导入{len(qa_pairs)}条问答。"
+    return f"{md_file} 已同步到Chroma，共{len(qa_pairs)}条问答：新增{added}条，删除{deleted}条，未变化{unchanged}条。"
+
+
+@mcp.tool()
+@instrument_tool
+async def import_md_directory(path: str, pattern: str = "*.md", workers: int = None, force: bool = False, ctx: Context = None) -> str:
+    """
+    批量导入目录（或glob匹配）下的所有md文件：多线程并行解析，所有文件的新增行汇入同一个批量嵌入流程。
+    文件清单中记录了各文件的内容哈希，中断后重新执行会跳过已导入、内容未变化且库中条数一致的文件
+    Args:
+        path: 目录路径（递归查找）或glob表达式，如 qa_files/**/*.md
+        pattern: path为目录时匹配的文件名模式，默认*.md
+        workers: 并行解析的线程数（可选，默认QA_IMPORT_WORKERS）
+        force: 为true时忽略文件清单，重新对比所有文件
+    Returns:
+        导入结果汇总：文件数、跳过数、失败数、新增和删除的条数以及吞吐
+    """
+    files = await run_blocking(collect_md_files, path, pattern)
+    if not files:
+        return f"{path} 下未找到匹配 {pattern} 的md文件。"
+
+    # 不同目录下的同名文件会映射到同一个md_file而互相覆盖，只导入第一个
+    seen_names = {}
+    duplicates = []
+    for f in files:
+        name = get_md_file_name(f)
+        if name in seen_names:
+            duplicates.append(f"{f}（与 {seen_names[name]} 同名）")
+        else:
+            seen_names[name] = f
+    files = list(seen_names.values())
+
+    started = time.perf_counter()
+    stats = {"files_done": 0, "skipped": 0, "added": 0, "deleted": 0, "rows_embedded": 0}
+    failed = []
+    pending_rows = []
+    remaining = {}
+    prepared = {}
+
+    async def report():
+        elapsed = time.perf_counter() - started
+        rate = stats["rows_embedded"] / elapsed if elapsed > 0 else 0.0
+        message = f"已完成{stats['files_done']}/{len(files)}个文件，已嵌入{stats['rows_embedded']}条，{rate:.1f}条/秒"
+        print(message)
+        if ctx is not None:
+            # 进度通知只是辅助信息，发送失败（如客户端已断开）不影响导入
+            try:
+                await ctx.report_progress(stats["files_done"], len(files))
+                await ctx.info(message)
+            except Exception as e:
+                print(f"进度通知发送失败: {e}")
+
+    async def finish(item):
+        # 该文件的新增行全部写入后才删除旧行并记入清单，中断时清单里不会有写了一半的文件
+        if item["to_delete"]:
+            await run_blocking(delete_qa_records, item["to_delete"])
+        if item["to_reorder"]:
+            await run_blocking(update_qa_rows, item["to_reorder"])
+        await run_blocking(record_md_file_import, item["md_file"], item["content_hash"], item["path"], item["rows"])
+        stats["added"] += len(item["to_add"])
+        stats["deleted"] += len(item["to_delete"])
+        stats["files_done"] += 1
+        await report()
+
+    async def flush():
+        batch = pending_rows[:UPSERT_BATCH_SIZE]
+        del pending_rows[:UPSERT_BATCH_SIZE]
+        await run_blocking(
+            upsert_qa_records,
+            [row[1] for row in batch],
+            [row[2] for row in batch],
+            [row[3] for row in batch]
+        )
+        stats["rows_embedded"] += len(batch)
+        for row in batch:
+            remaining[row[0]] -= 1
+            if remaining[row[0]] == 0:
+                await finish(prepared.pop(row[0]))
+
+    loop = asyncio.get_running_loop()
+    parse_pool = ThreadPoolExecutor(max_workers=max(1, int(workers or IMPORT_WORKERS)), thread_name_prefix="qa-import")
+    try:
+        futures = [loop.run_in_executor(parse_pool, contextvars.copy_context().run, prepare_import_file, f, force)
+                   for f in files]
+        for next_done in asyncio.as_completed(futures):
+            item = await next_done
+            if "error" in item:
+                failed.append(f"{item['path']}: {item['error']}")
+                stats["files_done"] += 1
+                continue
+            if item["skipped"]:
+                stats["skipped"] += 1
+                stats["files_done"] += 1
+                continue
+            if not item["to_add"]:
+                await finish(item)
+                continue
+            prepared[item["path"]] = item
+            remaining[item["path"]] = len(item["to_add"])
+            for qa in item["to_add"]:
+                pending_rows.append((
+                    item["path"],
+                    qa['id'],
+                    qa['question'] + '\n' + qa['answer'],
+                    build_qa_metadata(qa['question'], qa['answer'], item["md_file"], qa['row'])
+                ))
+            while len(pending_rows) >= UPSERT_BATCH_SIZE:
+                await flush()
+        while pending_rows:
+            await flush()
+    finally:
+        parse_pool.shutdown(wait=False)
+
+    elapsed = time.perf_counter() - started
+    rate = stats["rows_embedded"] / elapsed if elapsed > 0 else 0.0
+    lines = [
+        f"批量导入完成：共{len(files)}个文件，跳过未变化{stats['skipped']}个，失败{len(failed)}个；"
+        f"新增{stats['added']}条，删除{stats['deleted']}条，耗时{elapsed:.2f}秒，{rate:.1f}条/秒。"
+    ]
+    if duplicates:
+        lines.append("以下文件与已导入文件同名，未导入：\n" + "\n".join(duplicates))
+    if failed:
+        lines.append("以下文件导入失败：\n" + "\n".join(failed))
+    return "\n".join(lines)
 
 
 @mcp.tool()
+@instrument_tool
 async def list_imported_md_files() -> str:
     """
-    获取已导入Chroma的md文件名列表
+    获取已导入Chroma的md文件名列表（读取文件清单，不扫描全部问答）
     Args:
         无
     Returns:
-        已导入的Markdown文件名列表（以换行分隔的字符串）
+        已导入的Markdown文件名列表（以换行分隔的字符串），每行附带条数和最近导入、导出时间
     """
-    imported_files = get_imported_md_files()
-    if not imported_files:
+    manifest = await run_blocking(get_md_file_manifest)
+    if not manifest:
         return "目前没有导入Chroma的MD文件。"
-    return "\n".join(imported_files)
+    lines = []
+    for entry in manifest:
+        details = [f"{entry['rows']}条"]
+        if entry["last_import_at"]:
+            details.append(f"最近导入：{format_timestamp(entry['last_import_at'])}")
+        if entry["last_export_at"]:
+            details.append(f"最近导出：{format_timestamp(entry['last_export_at'])}")
+        lines.append(f"{entry['md_file']}（{'，'.join(details)}）")
+    return "\n".join(lines)
+
+
+def format_timestamp(timestamp):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))
 
 
 @mcp.tool()
-async def rag_qa(query: str, md_file: str = None, top_k: int = 3) -> str:
+@instrument_tool
+async def rag_qa(query: str, md_file: str = None, top_k: int = 3, mode: str = None) -> str:
     """
-    用向量相似度检索返回最相关的问答，可选限定md文件，返回id方便后续操作
+    检索返回最相关的问答，可选限定md文件，返回id方便后续操作。默认仅向量检索（由QA_RAG_MODE配置）；
+    mode为hybrid时向量相似度与BM25关键词检索按排名融合，对API名、错误码、专有名词等精确词更准确
     Args:
         query: 需要在本地数据库查询的相关内容
         md_file: 需要在本地数据库查询的文档名称（可选）
         top_k: 需要多少条相关内容的数量，默认是1条，最大是10条
+        mode: 检索方式，hybrid（混合）或 vector（仅向量），默认由QA_RAG_MODE配置
     Returns:
         搜索本地数据库的结果
     """
-    filename = os.path.basename(md_file)
-    filename = os.path.splitext(filename)[0]
+    filename = os.path.splitext(os.path.basename(md_file))[0] if md_file else None
     where = {"md_file": filename} if filename else None
-    results = qa_collection.query(query_embeddings=embedding_function([query]), n_results=top_k, where=where, include=["documents", "metadatas", "distances"])
-    print(results)
-    if not results or not results.get('ids') or len(results['ids'][0]) == 0:
-        return "未检索到相关内容。"
+    mode = (mode or RAG_MODE).lower()
+
+    async def vector_search(n_results):
+        query_embedding = await embed_query(query)
+        return await run_blocking(lambda: get_qa_collection().query(query_embeddings=[query_embedding], n_results=n_results, where=where, include=["documents", "metadatas", "distances"]))
+
+    if mode != "hybrid":
+        results = await vector_search(top_k)
+        print(results)
+        if not results or not results.get('ids') or len(results['ids'][0]) == 0:
+            return "未检索到相关内容。"
+        rows = list(zip(results['ids'][0], results['metadatas'][0]))
+    else:
+        # 两路并行，各自多取一些候选再融合
+        fetch = max(top_k, top_k * HYBRID_OVERFETCH)
+        results, lexical_hits = await asyncio.gather(
+            vector_search(fetch),
+            run_blocking(lambda: ensure_lexical_index().search(query, fetch, filename))
+        )
+        vector_ids = results['ids'][0] if results and results.get('ids') else []
+        metadatas = dict(zip(vector_ids, results['metadatas'][0])) if vector_ids else {}
+        ranked = fuse_rankings(
+            [vector_ids, [doc_id for doc_id, _ in lexical_hits]],
+            [HYBRID_VECTOR_WEIGHT, HYBRID_LEXICAL_WEIGHT],
+            top_k
+        )
+        # 只由关键词命中的记录补取metadata
+        missing = [doc_id for doc_id in ranked if doc_id not in metadatas]
+        if missing:
+            extra = await run_blocking(lambda: get_qa_collection().get(ids=missing, include=["metadatas"]))
+            metadatas.update(zip(extra["ids"], extra["metadatas"]))
+        rows = [(doc_id, metadatas[doc_id]) for doc_id in ranked if doc_id in metadatas]
+        if not rows:
+            return "未检索到相关内容。"
     output = []
-    for meta, qa_id in zip(results['metadatas'][0], results['ids'][0]):
+    for qa_id, meta in rows:
         q = meta.get('question', '').replace("|", "｜").replace("[换行]", "<br>")
         a = meta.get('answer', '').replace("|", "｜").replace("[换行]", "<br>")
         output.append(json.dumps({
@@ -225,8 +1711,98 @@ async def rag_qa(query: str, md_file: str = None, top_k: int = 3) -> str:
     return "\n".join(output)
 
 
+@mcp.tool()
+@instrument_tool
+async def rag_qa_batch(queries: list, mode: str = None) -> str:
+    """
+    一次检索多个子问题：所有查询合并成一次批量编码，相同md_file筛选的查询合并成一次Chroma批量查询，结果按查询分组并去重
+    Args:
+        queries: 查询列表，每项为{"query": 查询内容, "top_k": 条数(可选，默认3，最大10), "md_file": md文件名(可选)}，也可以直接是查询字符串
+        mode: 检索方式，hybrid（混合）或 vector（仅向量），默认由QA_RAG_MODE配置
+    Returns:
+        JSON字符串：queries为每个查询命中的id列表（按相关度排序），qa为这些id对应的问答内容（每条只出现一次）
+    """
+    if not isinstance(queries, list) or not queries:
+        return "queries参数必须为非空列表。"
+    items = []
+    for item in queries:
+        if isinstance(item, str):
+            item = {"query": item}
+        if not isinstance(item, dict) or not str(item.get("query", "")).strip():
+            continue
+        md_file = item.get("md_file")
+        items.append({
+            "query": str(item["query"]),
+            "top_k": min(max(int(item.get("top_k") or 3), 1), 10),
+            "md_file": os.path.splitext(os.path.basename(md_file))[0] if md_file else None,
+        })
+    if not items:
+        return "queries中没有有效的查询。"
+    mode = (mode or RAG_MODE).lower()
+    overfetch = HYBRID_OVERFETCH if mode == "hybrid" else 1
+
+    embeddings = await embed_queries([item["query"] for item in items])
+    # Chroma一次查询只能带一个where条件，按md_file分组，每组一次批量查询
+    groups = {}
+    for i, item in enumerate(items):
+        groups.setdefault(item["md_file"], []).append(i)
+
+    def query_group(md_file, indexes):
+        n_results = max(items[i]["top_k"] for i in indexes) * overfetch
+        return get_qa_collection().query(
+            query_embeddings=[embeddings[i] for i in indexes],
+            n_results=n_results,
+            where={"md_file": md_file} if md_file else None,
+            include=["metadatas"]
+        )
+
+    def lexical_search_all():
+        index = ensure_lexical_index()
+        return [index.search(item["query"], item["top_k"] * HYBRID_OVERFETCH, item["md_file"]) for item in items]
+
+    tasks = [run_blocking(query_group, md_file, indexes) for md_file, indexes in groups.items()]
+    if mode == "hybrid":
+        tasks.append(run_blocking(lexical_search_all))
+    outputs = await asyncio.gather(*tasks)
+
+    metadatas = {}
+    vector_ids = [[] for _ in items]
+    for (md_file, indexes), results in zip(groups.items(), outputs):
+        for position, i in enumerate(indexes):
+            vector_ids[i] = results["ids"][position]
+            metadatas.update(zip(results["ids"][position], results["metadatas"][position]))
+
+    ranked = []
+    for i, item in enumerate(items):
+        if mode == "hybrid":
+            lexical_ids = [doc_id for doc_id, _ in outputs[-1][i]]
+            ranked.append(fuse_rankings([vector_ids[i], lexical_ids], [HYBRID_VECTOR_WEIGHT, HYBRID_LEXICAL_WEIGHT], item["top_k"]))
+        else:
+            ranked.append(vector_ids[i][:item["top_k"]])
+
+    missing = list({doc_id for ids in ranked for doc_id in ids if doc_id not in metadatas})
+    if missing:
+        extra = await run_blocking(lambda: get_qa_collection().get(ids=missing, include=["metadatas"]))
+        metadatas.update(zip(extra["ids"], extra["metadatas"]))
+
+    qa = {}
+    grouped = []
+    for item, ids in zip(items, ranked):
+        ids = [doc_id for doc_id in ids if doc_id in metadatas]
+        grouped.append({"query": item["query"], "md_file": item["md_file"], "ids": ids})
+        for doc_id in ids:
+            if doc_id not in qa:
+                meta = metadatas[doc_id]
+                qa[doc_id] = {
+                    "问题": meta.get('question', '').replace("|", "｜").replace("[换行]", "<br>"),
+                    "答案": meta.get('answer', '').replace("|", "｜").replace("[换行]", "<br>"),
+                    "md_file": meta.get('md_file', '未知')
+                }
+    return json.dumps({"queries": grouped, "qa": qa}, ensure_ascii=False, indent=2)
+
 
 @mcp.tool()
+@instrument_tool
 async def preview_modify(qa_id: str, new_question: str = None, new_answer: str = None) -> dict:
     """
     预览修改某对QA内容，返回修改前后的对比信息
@@ -237,7 +1813,7 @@ async def preview_modify(qa_id: str, new_question: str = None, new_answer: str =
     Returns:
         修改前后的问答内容对比信息
     """
-    preview = preview_modify_qa(qa_id, new_question, new_answer)
+    preview = await run_blocking(preview_modify_qa, qa_id, new_question, new_answer)
     if not preview:
         return {"error": "未找到该QA。"}
     tips = []
@@ -255,6 +1831,7 @@ async def preview_modify(qa_id: str, new_question: str = None, new_answer: str =
 
 
 @mcp.tool()
+@instrument_tool
 async def confirm_modify(qa_id: str, new_question: str = None, new_answer: str = None) -> str:
     """
     确认并保存对某对QA的修改
@@ -265,14 +1842,20 @@ async def confirm_modify(qa_id: str, new_question: str = None, new_answer: str =
     Returns:
         修改结果的提示信息
     """
-    if update_qa(qa_id, new_question, new_answer):
-        return "修改已完成。"
-    else:
+    result = await run_blocking(update_qa, qa_id, new_question, new_answer)
+    if not result:
         return "修改失败，未找到该问答对。"
+    message = "修改已完成。"
+    if result["qa_id"] != qa_id:
+        message += f"内容已变化，新的id: {result['qa_id']}。"
+    if result["writeback_path"]:
+        message += f"{WRITEBACK_INTERVAL:g}秒后将同步写回 {result['writeback_path']}。"
+    return message
 
 
 
 @mcp.tool()
+@instrument_tool
 async def delete_qa(qa_id: str) -> str:
     """
     从Chroma数据库中删除指定的QA对
@@ -281,7 +1864,7 @@ async def delete_qa(qa_id: str) -> str:
     Returns:
         删除结果的提示信息
     """
-    result = qa_collection.get(ids=[qa_id], include=["metadatas"])
+    result = await run_blocking(lambda: get_qa_collection().get(ids=[qa_id], include=["metadatas"]))
 
     if not result or not result["ids"]:
         return "未找到该QA对。"
@@ -292,9 +1875,13 @@ async def delete_qa(qa_id: str) -> str:
     answer = metadata["answer"]
 
     # 从Chroma删除
-    qa_collection.delete(ids=[qa_id])
+    await run_blocking(delete_qa_records, [qa_id])
 
-    # 如果有关联的md文件，提示用户需要手动更新
+    writeback_path = await run_blocking(enqueue_md_writeback, md_file, "delete", question, answer)
+    if writeback_path:
+        return f"已从Chroma删除问答对，{WRITEBACK_INTERVAL:g}秒后将同步从 {writeback_path} 中删除该行。"
+
+    # 关联的md文件不在文件清单中（未从文件导入或源文件已不存在），提示用户需要手动更新
     if md_file:
         return f"已从Chroma删除问答对，但需要手动从 {md_file} 文件中删除以下内容：\n问题：{question}\n答案：{answer}"
 
@@ -302,15 +1889,18 @@ async def delete_qa(qa_id: str) -> str:
 
 
 @mcp.tool()
-async def list_qa_pairs(md_file: str = None, page: int = 1, page_size: int = 10) -> str:
+@instrument_tool
+async def list_qa_pairs(md_file: str = None, page: int = 1, page_size: int = 10, cursor: int = None) -> str:
     """
-    分页获取已存储的QA对内容，可选按md文件筛选，便于浏览全部问答内容
+    分页获取已存储的QA对内容，可选按md文件筛选，便于浏览全部问答内容。按写入顺序稳定排序，
+    翻页时可传入上一页返回的next_cursor代替page，数据有增删时也不会重复或遗漏
     Args:
         md_file: 需要筛选的md文件名（可选）
-        page: 页码，从1开始，默认第1页
+        page: 页码，从1开始，默认第1页（传入cursor时忽略）
         page_size: 每页条数，默认10，最大100
+        cursor: 上一页返回的next_cursor（可选）
     Returns:
-        指定页的问答内容列表（JSON字符串），包含id、问题、答案、md_file
+        指定页的问答内容列表（JSON字符串），包含id、问题、答案、md_file，以及总数和下一页的next_cursor
     """
     try:
         page = int(page)
@@ -324,23 +1914,23 @@ async def list_qa_pairs(md_file: str = None, page: int = 1, page_size: int = 10)
     except Exception:
         page, page_size = 1, 10
 
-    where = None
+    filename = None
+    conditions = []
     if md_file:
         filename = os.path.basename(md_file)
         filename = os.path.splitext(filename)[0]
-        where = {"md_file": filename}
+        conditions.append({"md_file": filename})
+    if cursor is not None:
+        conditions.append({"seq": {"$gt": int(cursor)}})
+    where = conditions[0] if len(conditions) == 1 else ({"$and": conditions} if conditions else None)
+    offset = 0 if cursor is not None else (page - 1) * page_size
 
-    # 获取全部匹配的QA对
-    results = qa_collection.get(where=where, include=["metadatas"])
-    ids = results.get("ids", [])
-    metadatas = results.get("metadatas", [])
-    total = len(ids)
-    start = (page - 1) * page_size
-    end = start + page_size
-    page_ids = ids[start:end]
-    page_metas = metadatas[start:end]
+    # 分页下推到Chroma，只取当前页的记录
+    results = await run_blocking(lambda: get_qa_collection().get(where=where, limit=page_size, offset=offset, include=["metadatas"]))
+    total = await run_blocking(count_qa_pairs, filename)
+    rows = sorted(zip(results.get("ids", []), results.get("metadatas", [])), key=lambda row: row[1].get("seq", 0))
     output = []
-    for qa_id, meta in zip(page_ids, page_metas):
+    for qa_id, meta in rows:
         q = meta.get('question', '').replace("|", "｜").replace("[换行]", "<br>")
         a = meta.get('answer', '').replace("|", "｜").replace("[换行]", "<br>")
         output.append({
@@ -351,13 +1941,15 @@ async def list_qa_pairs(md_file: str = None, page: int = 1, page_size: int = 10)
         })
     return json.dumps({
         "total": total,
-        "page": page,
+        "page": page if cursor is None else None,
         "page_size": page_size,
+        "next_cursor": rows[-1][1].get("seq") if len(rows) == page_size else None,
         "data": output
     }, ensure_ascii=False, indent=2)
 
 
 @mcp.tool()
+@instrument_tool
 async def add_qa_pairs(qa_list: list, md_file: str = "manual") -> str:
     """
     批量添加问答对到数据库，支持去重校验（同一md_file下问题和答案完全相同则视为重复）
@@ -369,45 +1961,127 @@ async def add_qa_pairs(qa_list: list, md_file: str = "manual") -> str:
     """
     if not isinstance(qa_list, list) or not qa_list:
         return "qa_list参数必须为非空列表。"
-    # 获取当前md_file下所有已存在的问答对
-    where = {"md_file": md_file} if md_file else None
-    exist = qa_collection.get(where=where, include=["metadatas"])
-    exist_set = set()
-    for meta in exist.get("metadatas", []):
-        exist_set.add((meta.get("question", "").strip(), meta.get("answer", "").strip()))
-    add_count = 0
+    started = time.perf_counter()
+    # 第一步：按内容生成ID并去掉本批次内的重复项
     repeat_count = 0
-    added_ids = []
+    candidates = {}
     for qa in qa_list:
         q = qa.get("question", "").strip()
         a = qa.get("answer", "").strip()
         if not q or not a:
             continue
-        if (q, a) in exist_set:
-            repeat_count += 1
-            continue
-        qa_id = str(uuid4())
         question = safe_text(q)
         answer = safe_text(a)
-        qa_collection.upsert(
-            ids=[qa_id],
-            documents=[question + '\n' + answer],
-            embeddings=embedding_function([question + '\n' + answer]),
-            metadatas=[{"question": question, "answer": answer, "md_file": md_file}]
+        qa_id = make_qa_id(md_file, question, answer)
+        if qa_id in candidates:
+            repeat_count += 1
+            continue
+        candidates[qa_id] = (question, answer)
+
+    # 只按ID查询库中是否已存在，不需要读取该md_file的全部记录
+    exist_ids = await run_blocking(find_existing_qa_ids, list(candidates))
+    ids = []
+    documents = []
+    metadatas = []
+    for qa_id, (question, answer) in candidates.items():
+        if qa_id in exist_ids:
+            repeat_count += 1
+            continue
+        ids.append(qa_id)
+        documents.append(question + '\n' + answer)
+        metadatas.append(build_qa_metadata(question, answer, md_file))
+
+    # 第二步：小批量嵌入，第三步：分块写入
+    embed_seconds, upsert_seconds = await run_blocking(upsert_qa_records, ids, documents, metadatas) if ids else (0.0, 0.0)
+    elapsed = time.perf_counter() - started
+    rate = len(ids) / elapsed if elapsed > 0 else 0.0
+    return (f"批量添加完成，成功添加{len(ids)}条，重复{repeat_count}条。"
+            f"耗时{elapsed:.2f}秒（嵌入{embed_seconds:.2f}秒，写入{upsert_seconds:.2f}秒），{rate:.1f}条/秒。"
+            f"新添加的id: {ids}")
+
+
+# 导出时每次从Chroma读取的记录条数，读出的数据先落到临时SQLite，再按行序流式写出，内存占用与总条数无关
+EXPORT_PAGE_SIZE = int(os.getenv("QA_EXPORT_PAGE_SIZE", "1000"))
+MD_TABLE_HEADER = ["# QA笔记\n", "## 问答", "| 问题 | 答案 |", "|:---|:---|"]
+
+
+def spill_qa_records(where=None):
+    """分页读取Chroma中的问答写入临时SQLite，返回(连接, 临时文件路径)，调用方负责关闭和删除"""
+    fd, spill_path = tempfile.mkstemp(suffix=".sqlite3", prefix="qa_export_")
+    os.close(fd)
+    conn = sqlite3.connect(spill_path)
+    conn.execute("CREATE TABLE qa (md_file TEXT, row INTEGER, seq INTEGER, question TEXT, answer TEXT)")
+    collection = get_qa_collection()
+    offset = 0
+    while True:
+        page = collection.get(where=where, limit=EXPORT_PAGE_SIZE, offset=offset, include=["metadatas"])
+        metadatas = page.get("metadatas") or []
+        if not metadatas:
+            break
+        conn.executemany(
+            "INSERT INTO qa (md_file, row, seq, question, answer) VALUES (?, ?, ?, ?, ?)",
+            [(meta.get("md_file", ""), meta.get("row"), meta.get("seq"),
+              meta.get("question", ""), meta.get("answer", "")) for meta in metadatas]
         )
-        exist_set.add((question, answer))
-        add_count += 1
-        added_ids.append(qa_id)
-    return f"批量添加完成，成功添加{add_count}条，重复{repeat_count}条。新添加的id: {added_ids}"
+        offset += len(metadatas)
+        if len(metadatas) < EXPORT_PAGE_SIZE:
+            break
+    conn.execute("CREATE INDEX idx_qa_order ON qa (md_file, row, seq)")
+    conn.commit()
+    return conn, spill_path
+
+
+def write_md_table_from_spill(conn, md_file, output_path):
+    """按导入时的行序（新增的记录按seq排在后面）流式写出一个md文件，先写临时文件再替换，返回条数"""
+    cursor = conn.execute(
+        "SELECT question, answer FROM qa WHERE md_file = ? ORDER BY row IS NULL, row, seq",
+        (md_file,)
+    )
+    output_dir = os.path.dirname(os.path.abspath(output_path))
+    fd, tmp_path = tempfile.mkstemp(dir=output_dir, prefix=".export_", suffix=".md")
+    count = 0
+    try:
+        with trace_span("file_io") as span:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write("\n".join(MD_TABLE_HEADER))
+                for question, answer in cursor:
+                    f.write(f"\n| {md_cell_safe(question)} | {md_cell_safe(answer)} |")
+                    count += 1
+            os.replace(tmp_path, output_path)
+            span["items"] = count
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
+    return count
+
+
+def export_md_files(md_file=None, output_path=None, output_dir="."):
+    """导出单个md_file（指定md_file时）或一次遍历导出全部md_file，返回[(md_file, 路径, 条数)]"""
+    conn, spill_path = spill_qa_records({"md_file": md_file} if md_file else None)
+    try:
+        names = [row[0] for row in conn.execute("SELECT DISTINCT md_file FROM qa ORDER BY md_file")]
+        exported = []
+        for name in names:
+            path = output_path if md_file else os.path.join(output_dir, f"{name}.md")
+            count = write_md_table_from_spill(conn, name, path)
+            record_md_file_export(name, path)
+            exported.append((name, path, count))
+        return exported
+    finally:
+        conn.close()
+        with contextlib.suppress(OSError):
+            os.remove(spill_path)
 
 
 @mcp.tool()
+@instrument_tool
 async def export_md_from_db(md_file: str, output_path: str = None) -> str:
     """
-    导出数据库中指定md_file的所有QA数据到md文件，表格结构与原始构建时一致
+    导出数据库中指定md_file的所有QA数据到md文件，表格结构和行序与原始构建时一致
     Args:
         md_file: 需要导出的md文件名（不带扩展名也可）
-        output_path: 导出md文件的保存路径（可选，默认当前目录下md_file_exported.md）
+        output_path: 导出md文件的保存路径（可选，默认当前目录下md_file.md）
     Returns:
         导出结果的提示信息，包含导出文件路径和导出条数
     """
@@ -415,23 +2089,31 @@ async def export_md_from_db(md_file: str, output_path: str = None) -> str:
         return "md_file参数不能为空。"
     filename = os.path.basename(md_file)
     filename = os.path.splitext(filename)[0]
-    where = {"md_file": filename}
-    results = qa_collection.get(where=where, include=["metadatas"])
-    metadatas = results.get("metadatas", [])
-    if not metadatas:
-        return f"未找到md_file={filename}的问答数据。"
-    # 构建markdown表格
-    lines = ["# QA笔记\n","## 问答","| 问题 | 答案 |", "|:---|:---|"]
-    for meta in metadatas:
-        q = md_cell_safe(meta.get("question", ""))
-        a = md_cell_safe(meta.get("answer", ""))
-        lines.append(f"| {q} | {a} |")
-    md_content = "\n".join(lines)
     if not output_path:
         output_path = f"{filename}.md"
-    with open(output_path, "w", encoding="utf-8") as f:
-        f.write(md_content)
-    return f"已导出{len(metadatas)}条问答到: {output_path}"
+    exported = await run_blocking(export_md_files, filename, output_path)
+    if not exported:
+        return f"未找到md_file={filename}的问答数据。"
+    return f"已导出{exported[0][2]}条问答到: {output_path}"
+
+
+@mcp.tool()
+@instrument_tool
+async def export_all_md_from_db(output_dir: str = "exported_md") -> str:
+    """
+    一次遍历导出数据库中全部md_file，每个md_file各导出为一个md文件，行序与原始构建时一致
+    Args:
+        output_dir: 导出目录（可选，默认当前目录下exported_md，不存在时自动创建）
+    Returns:
+        导出结果的提示信息，包含每个文件的路径和导出条数
+    """
+    await run_blocking(os.makedirs, output_dir, exist_ok=True)
+    exported = await run_blocking(export_md_files, None, None, output_dir)
+    if not exported:
+        return "数据库中没有问答数据。"
+    total = sum(count for _, _, count in exported)
+    details = "\n".join(f"{path}（{count}条）" for _, path, count in exported)
+    return f"已导出{len(exported)}个md文件，共{total}条问答到: {output_dir}\n{details}"
 
 
 def md_cell_safe(text):
@@ -439,6 +2121,92 @@ def md_cell_safe(text):
     return str(text).replace('|', '｜').replace('[换行]', '<br>').replace('\n', '<br>')
 
 
+@mcp.tool()
+@instrument_tool
+async def embedding_cache_info() -> dict:
+    """
+    查看嵌入向量缓存（SQLite持久化缓存和rag_qa查询向量LRU）的命中率和容量
+    Args:
+        无
+    Returns:
+        命中数、未命中数、命中率、淘汰数和当前条目数，query_cache为查询向量LRU的统计
+    """
+    def read_size():
+        with _embedding_cache_lock:
+            get_embedding_cache_conn()
+            return _embedding_cache_size
+
+    size = await run_blocking(read_size)
+    hits = embedding_cache_stats["hits"]
+    misses = embedding_cache_stats["misses"]
+    query_hits = query_cache_stats["hits"]
+    query_misses = query_cache_stats["misses"]
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+        "evictions": embedding_cache_stats["evictions"],
+        "entries": size,
+        "max_entries": EMBEDDING_CACHE_MAX_ENTRIES,
+        "query_cache": {
+            **query_cache_stats,
+            "hit_rate": round(query_hits / (query_hits + query_misses), 4) if query_hits + query_misses else 0.0,
+            "entries": len(_query_cache),
+            "max_entries": QUERY_CACHE_SIZE,
+        },
+    }
+
+
+@mcp.tool()
+@instrument_tool
+async def writeback_status(flush: bool = False) -> dict:
+    """
+    查看修改/删除写回源md文件的队列状态和最近的冲突
+    Args:
+        flush: 为true时不等防抖间隔，立即写回所有待处理的修改
+    Returns:
+        待写回的文件和条数、已写回的条数和文件数、最近一次写回时间以及最近的冲突记录
+    """
+    if flush:
+        await run_blocking(flush_md_writeback, True)
+    with _writeback_cond:
+        pending = {path: len(ops) for path, ops in _writeback_queue.items()}
+    return {
+        "enabled": WRITEBACK_ENABLED,
+        "interval_seconds": WRITEBACK_INTERVAL,
+        "pending": pending,
+        "applied": writeback_state["applied"],
+        "files_written": writeback_state["files_written"],
+        "last_flush_at": format_timestamp(writeback_state["last_flush_at"]) if writeback_state["last_flush_at"] else None,
+        "conflicts": writeback_state["conflicts"],
+    }
+
+
+@mcp.tool()
+@instrument_tool
+async def service_status() -> dict:
+    """
+    查看服务就绪状态（Chroma和嵌入模型是否已加载）
+    Args:
+        无
+    Returns:
+        Chroma和嵌入模型的加载状态、耗时以及配置的路径
+    """
+    return {
+        **service_state,
+        "ready": service_state["chroma"] == "ready" and service_state["model"] == "ready",
+        "query_batches": dict(query_batch_stats),
+        "change_feed": {
+            **change_feed_state,
+            "path": CHANGE_FEED_PATH or None,
+            "last_applied_at": format_timestamp(change_feed_state["last_applied_at"]) if change_feed_state["last_applied_at"] else None,
+        },
+        "chroma_db_dir": CHROMA_DB_DIR,
+        "embedding_model": EMBEDDING_MODEL,
+        "embedding_backend": EMBEDDING_BACKEND,
+    }
+
+
 # SSE服务部分
 def create_starlette_app(mcp_server: Server, *, debug: bool = False) -> Starlette:
     sse = SseServerTransport("/messages/")
@@ -455,52 +2223,127 @@ def create_starlette_app(mcp_server: Server, *, debug: bool = False) -> Starlett
                 mcp_server.create_initialization_options(),
             )
 
+    @contextlib.asynccontextmanager
+    async def lifespan(app: Starlette):
+        # 不阻塞服务启动，监听开始后在后台加载
+        if WARMUP_ON_START:
+            threading.Thread(target=warm_up_service, name="service-warmup", daemon=True).start()
+        if CHANGE_FEED_PATH:
+            threading.Thread(target=change_feed_loop, name="change-feed", daemon=True).start()
+        yield
+        # 退出前把还在防抖等待中的修改写回md文件
+        await run_blocking(flush_md_writeback, True)
+
+    async def handle_metrics(request: Request) -> PlainTextResponse:
+        return PlainTextResponse(format_metrics(), media_type="text/plain; version=0.0.4")
+
     return Starlette(
         debug=debug,
         routes=[
             Route("/sse", endpoint=handle_sse),
+            Route("/metrics", endpoint=handle_metrics),
             Mount("/messages/", app=sse.handle_post_message),
         ],
+        lifespan=lifespan,
     )
 
 
 @mcp.tool()
-async def list_incomplete_qa(md_file: str = None) -> dict:
+@instrument_tool
+async def list_incomplete_qa(md_file: str = None, page: int = 1, page_size: int = 50) -> dict:
     """
-    查询数据库中缺失问题或答案的QA对，支持可选md_file筛选
+    查询数据库中缺失问题或答案的QA对，支持可选md_file筛选和分页
     Args:
         md_file: 需要筛选的md文件名（可选）
+        page: 页码，从1开始，默认第1页
+        page_size: 每页条数，默认50，最大500
     Returns:
-        包含所有缺失问题或答案的QA对列表（含id、问题、答案、md_file）
+        缺失问题或答案的QA对总数和指定页的列表（含id、问题、答案、md_file）
     """
-    where = None
+    try:
+        page = max(1, int(page))
+        page_size = min(max(1, int(page_size)), 500)
+    except Exception:
+        page, page_size = 1, 50
+    where = {"complete": False}
     if md_file:
         filename = os.path.basename(md_file)
         filename = os.path.splitext(filename)[0]
-        where = {"md_file": filename}
-    results = qa_collection.get(where=where, include=["metadatas"])
-    ids = results.get("ids", [])
-    metadatas = results.get("metadatas", [])
+        where = {"$and": [{"md_file": filename}, where]}
+    # 由Chroma按complete字段筛选，总数只取id不取metadata
+    matched = await run_blocking(lambda: get_qa_collection().get(where=where, include=[]))
+    results = await run_blocking(lambda: get_qa_collection().get(where=where, limit=page_size, offset=(page - 1) * page_size, include=["metadatas"]))
+    rows = sorted(zip(results.get("ids", []), results.get("metadatas", [])), key=lambda row: row[1].get("seq", 0))
     incomplete = []
-    for qa_id, meta in zip(ids, metadatas):
-        q = meta.get('question', '').strip()
-        a = meta.get('answer', '').strip()
-        if not q or not a:
-            incomplete.append({
-                "id": qa_id,
-                "问题": q,
-                "答案": a,
-                "md_file": meta.get('md_file', '未知')
-            })
-    return {"count": len(incomplete), "data": incomplete}
+    for qa_id, meta in rows:
+        incomplete.append({
+            "id": qa_id,
+            "问题": meta.get('question', '').strip(),
+            "答案": meta.get('answer', '').strip(),
+            "md_file": meta.get('md_file', '未知')
+        })
+    return {"count": len(matched.get("ids", [])), "page": page, "page_size": page_size, "data": incomplete}
+
+
+def load_benchmark_texts(source, limit):
+    """从md文件（目录或glob）取问答文本作为基准语料，没有时生成合成文本"""
+    texts = []
+    if source:
+        for path in collect_md_files(source):
+            texts.extend(qa['question'] + '\n' + qa['answer'] for qa in parse_md_qa_table(path))
+            if len(texts) >= limit:
+                break
+    if not texts:
+        texts = [f"第{i}个问题：如何处理 error_{i % 97} 以及相关的配置项？\n答案{i}：检查日志并重试。" for i in range(limit)]
+    return texts[:limit]
+
+
+def benchmark_embedding_backends(names, texts, batch_size=None):
+    """用同一批文本依次测试各后端（绕过嵌入缓存），返回每个后端的加载耗时、向量维度和吞吐"""
+    batch_size = batch_size or EMBED_BATCH_SIZE
+    report = []
+    for name in names:
+        started = time.perf_counter()
+        try:
+            backend = create_embedding_backend(name)
+        except Exception as e:
+            report.append({"backend": name, "error": str(e)})
+            continue
+        load_seconds = time.perf_counter() - started
+        backend(texts[:1])
+        started = time.perf_counter()
+        dim = 0
+        for i in range(0, len(texts), batch_size):
+            vectors = backend(texts[i:i + batch_size])
+            dim = len(vectors[0]) if vectors else dim
+        elapsed = time.perf_counter() - started
+        report.append({
+            "backend": name,
+            "load_seconds": round(load_seconds, 3),
+            "dim": dim,
+            "texts": len(texts),
+            "seconds": round(elapsed, 3),
+            "texts_per_second": round(len(texts) / elapsed, 1) if elapsed > 0 else None,
+        })
+    return report
 
 
 if __name__ == "__main__":
     mcp_server = mcp._mcp_server
     import argparse
     parser = argparse.ArgumentParser(description='Run QA MCP SSE-based server')
+    parser.add_argument('command', nargs='?', default='serve', choices=['serve', 'bench-embed'], help='serve启动服务，bench-embed对比各嵌入后端的吞吐')
     parser.add_argument('--host', default='0.0.0.0', help='Host to bind to')
     parser.add_argument('--port', type=int, default=9000, help='Port to listen on')
+    parser.add_argument('--backends', default=",".join(EMBEDDING_BACKENDS), help='bench-embed要测试的后端，逗号分隔')
+    parser.add_argument('--source', default=None, help='bench-embed使用的md文件目录或glob，不填时使用合成文本')
+    parser.add_argument('--limit', type=int, default=1000, help='bench-embed的文本条数')
+    parser.add_argument('--batch-size', type=int, default=None, help='bench-embed每批文本条数，默认QA_EMBED_BATCH_SIZE')
     args = parser.parse_args()
-    starlette_app = create_starlette_app(mcp_server, debug=False)
-    uvicorn.run(starlette_app, host=args.host, port=args.port)
+    if args.command == 'bench-embed':
+        texts = load_benchmark_texts(args.source, args.limit)
+        for row in benchmark_embedding_backends([name.strip() for name in args.backends.split(",") if name.strip()], texts, args.batch_size):
+            print(json.dumps(row, ensure_ascii=False))
+    else:
+        starlette_app = create_starlette_app(mcp_server, debug=False)
+        uvicorn.run(starlette_app, host=args.host, port=args.port)